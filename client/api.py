@@ -6,7 +6,13 @@ import sys
 import json
 import os
 import logging
+from calibre_plugins.quietthyme.config import prefs
 from calibre_plugins.quietthyme.client.requestmanager import RequestManager
+from calibre_plugins.quietthyme.client.retry import RequestError
+from calibre_plugins.quietthyme.client.workerpool import BackgroundTask, WorkerPool
+from calibre_plugins.quietthyme.client.uploadjournal import UploadJournal
+from calibre_plugins.quietthyme.client.filesource import file_source
+from calibre_plugins.quietthyme.models.storagepath import StoragePath
 
 class ApiClient():
     def __init__(self):
@@ -49,6 +55,46 @@ class ApiClient():
         '''
         self.logger.debug(sys._getframe().f_code.co_name)
 
+        qt_metadata = self._qt_metadata_from_calibre(local_metadata)
+
+        json_data = json.dumps(qt_metadata, separators=(',', ':'))
+        self.logger.debug(json_data)
+
+        response = RequestManager.create_request('POST', '/book', json_data=json_data, query_args={'source': 'calibre'})
+        self.logger.debug(response['data']['id'])
+
+        qt_metadata['id'] = response['data']['id']
+        return qt_metadata
+        # resp = self._make_json_request(QNetworkAccessManager.PostOperation, "/book", json_data=json_data)
+        # resp.error.connect(self.handleError)
+        # resp.finished.connect(self.handleFinished)
+        # self.logger.debug(resp.readAll())
+
+    def create_books(self, local_metadata_list):
+        '''
+        This function will find or create many books in QuietThyme at once. The metadata is sent
+        in chunks of prefs['batch_size'] books per request.
+        :param local_metadata_list: list of calibre metadata
+        :return: a (qt_metadata, error_msg) tuple for every book, in order. error_msg is None on
+                 success. Returns None if QuietThyme does not support batch requests.
+        '''
+        self.logger.debug(sys._getframe().f_code.co_name)
+
+        qt_metadata_list = [self._qt_metadata_from_calibre(local_metadata) for local_metadata in local_metadata_list]
+        results = self._batch_request('/book/batch', qt_metadata_list, query_args={'source': 'calibre'})
+        if results is None:
+            return None
+
+        created = []
+        for qt_metadata, result in zip(qt_metadata_list, results):
+            if result.get('success'):
+                qt_metadata['id'] = result['data']['id']
+                created.append((qt_metadata, None))
+            else:
+                created.append((None, result.get('error_msg', 'Unknown error')))
+        return created
+
+    def _qt_metadata_from_calibre(self, local_metadata):
         #create QT book model.
         qt_metadata = {
             'title': local_metadata.title,
@@ -97,45 +143,118 @@ class ApiClient():
             qt_metadata['series_name'] = local_metadata.series.strip()
             qt_metadata['series_number'] = str(local_metadata.series_index)
 
-
-        json_data = json.dumps(qt_metadata, sort_keys=True,indent=4, separators=(',', ': '))
-        self.logger.debug(json_data)
-
-        response = RequestManager.create_request('POST', '/book', json_data=json_data, query_args={'source': 'calibre'})
-        self.logger.debug(response['data']['id'])
-
-        qt_metadata['id'] = response['data']['id']
         return qt_metadata
-        # resp = self._make_json_request(QNetworkAccessManager.PostOperation, "/book", json_data=json_data)
-        # resp.error.connect(self.handleError)
-        # resp.finished.connect(self.handleFinished)
-        # self.logger.debug(resp.readAll())
 
     def books_all(self, storage_id):
-        loaded_all = False
-
-        items = []
-        page = ""
-
-        while not loaded_all:
-            resp = self.books(storage_id, page)
-            items = items + resp["data"]["Items"]
-            page = resp["data"]["LastEvaluatedKey"]
-
-            if resp["data"]["LastEvaluatedKey"] == "":
-                loaded_all = True
-
-
         return {
             "data":{
-                "Items":items,
+                "Items":list(self.books_iter(storage_id)),
                 "LastEvaluatedKey": ""
             }
         }
 
+    def books_iter(self, storage_id, listing_info=None):
+        '''
+        This function will yield the book metadata for a storage one item at a time, without
+        loading the whole library into memory first.
+        :param listing_info: optional dict, populated with the HighWaterMark of the listing.
+        '''
+        for page in self.books_pages(storage_id, listing_info):
+            for item in page["Items"]:
+                yield item
+
+    def books_pages(self, storage_id, listing_info=None):
+        '''
+        This function will yield each page of book metadata for a storage. The next page is
+        requested in the background while the caller is still processing the current one.
+        :param listing_info: optional dict, populated with the HighWaterMark of the listing.
+        '''
+        pending = BackgroundTask(self.books, storage_id)
+        first_page = True
+        while pending is not None:
+            resp = pending.result()
+            page = resp["data"]["LastEvaluatedKey"]
+            pending = BackgroundTask(self.books, storage_id, page) if page != "" else None
+            if first_page and listing_info is not None:
+                # the cursor from the start of the listing, so that changes made while paging are not missed.
+                listing_info["HighWaterMark"] = resp["data"].get("HighWaterMark")
+            first_page = False
+            yield resp["data"]
+
+    def books_segmented(self, storage_id, total_segments, listing_info=None):
+        '''
+        This function will list the books for a storage as total_segments partitions that are
+        fetched in parallel (similar to a parallel scan), and yield the merged items as each
+        partition completes.
+        :param listing_info: optional dict, populated with the HighWaterMark of the listing.
+        '''
+        def fetch_segment(segment):
+            items = []
+            page = ""
+            high_water_mark = None
+            while True:
+                resp = self.books(storage_id, page, segment=segment, total_segments=total_segments)
+                if page == "":
+                    high_water_mark = resp["data"].get("HighWaterMark")
+                items.extend(resp["data"]["Items"])
+                page = resp["data"]["LastEvaluatedKey"]
+                if page == "":
+                    return items, high_water_mark
+
+        seen_ids = set()
+        high_water_marks = []
+        for segment, result, exc_info in WorkerPool(total_segments).imap_unordered(fetch_segment, range(total_segments)):
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            items, high_water_mark = result
+            high_water_marks.append(high_water_mark)
+            for item in items:
+                # partitions should not overlap, but never hand the same book back twice.
+                if item["id"] in seen_ids:
+                    continue
+                seen_ids.add(item["id"])
+                yield item
+
+        if listing_info is not None:
+            # the earliest cursor of all the partitions is the only one that is safe to resume from.
+            listing_info["HighWaterMark"] = None if None in high_water_marks else min(high_water_marks)
+
+    def books_changed(self, storage_id, modified_since):
+        '''
+        This function will download only the books that were changed or deleted since the
+        modified_since cursor (the HighWaterMark of an earlier listing).
+        :return: dict with the changed "Items", the "Deleted" book ids and the new "HighWaterMark",
+                 or None if QuietThyme does not support incremental listings.
+        '''
+        self.logger.debug(sys._getframe().f_code.co_name)
+
+        items = []
+        deleted = []
+        high_water_mark = None
+        page = ""
+        while True:
+            args = {'storage_id': storage_id, 'modified_since': modified_since}
+            if page != "":
+                args['page'] = page
+            resp = RequestManager.create_request('GET', '/book', query_args=args)
+            self.logger.debug(resp)
+            if "HighWaterMark" not in resp["data"]:
+                return None
+            if page == "":
+                high_water_mark = resp["data"]["HighWaterMark"]
+            items.extend(resp["data"]["Items"])
+            deleted.extend(resp["data"].get("Deleted", []))
+            page = resp["data"]["LastEvaluatedKey"]
+            if page == "":
+                break
 
+        return {
+            "Items": items,
+            "Deleted": deleted,
+            "HighWaterMark": high_water_mark
+        }
 
-    def books(self, storage_id, page=""):
+    def books(self, storage_id, page="", segment=None, total_segments=None):
         '''
         This function will download a list of book metadata from QuietThyme.
         '''
@@ -143,6 +262,9 @@ class ApiClient():
         args = {'storage_id': storage_id}
         if page != "":
             args['page'] = page;
+        if total_segments:
+            args['segment'] = segment
+            args['total_segments'] = total_segments
         response = RequestManager.create_request('GET', '/book', query_args=args)
         self.logger.debug(response)
         return response
@@ -151,7 +273,7 @@ class ApiClient():
     def prepare_bookstorage(self, qt_storage_metadata):
         self.logger.debug(sys._getframe().f_code.co_name)
 
-        json_data = json.dumps(qt_storage_metadata, sort_keys=True,indent=4, separators=(',', ': '))
+        json_data = json.dumps(qt_storage_metadata, separators=(',', ':'))
         self.logger.debug(json_data)
 
         response = RequestManager.create_request('POST', '/storage/prepare/book', json_data=json_data)
@@ -159,6 +281,49 @@ class ApiClient():
         return response
 
 
+    def prepare_bookstorage_many(self, qt_storage_metadata_list):
+        '''
+        This function will request signed upload urls for many books at once, in chunks of
+        prefs['batch_size'] books per request.
+        :return: a (qt_upload_data, error_msg) tuple for every book, in order. qt_upload_data has the
+                 same book_data and upload_url keys as the data of :meth:`prepare_bookstorage`.
+                 Returns None if QuietThyme does not support batch requests.
+        '''
+        self.logger.debug(sys._getframe().f_code.co_name)
+
+        results = self._batch_request('/storage/prepare/book/batch', qt_storage_metadata_list)
+        if results is None:
+            return None
+        return [(result['data'], None) if result.get('success') else (None, result.get('error_msg', 'Unknown error'))
+                for result in results]
+
+    def _batch_request(self, endpoint, payloads, query_args=None):
+        # POST the payloads in chunks, and return the per-item results ({success, data, error_msg}) in order.
+        # Returns None only if QuietThyme does not have the batch endpoint (404/405), any other failure
+        # is reported as an error for each item of the failed chunk.
+        results = []
+        batch_size = prefs['batch_size']
+        for offset in range(0, len(payloads), batch_size):
+            chunk = payloads[offset:offset + batch_size]
+            json_data = json.dumps(chunk, separators=(',', ':'))
+            try:
+                response = RequestManager.create_request('POST', endpoint, json_data=json_data, query_args=query_args)
+            except RequestError, e:
+                if offset == 0 and e.status in (404, 405):
+                    self.logger.info('Batch endpoint %s is not available: %s' % (endpoint, e))
+                    return None
+                self.logger.warning('Batch request to %s failed: %s' % (endpoint, e))
+                results.extend({'success': False, 'error_msg': str(e)} for payload in chunk)
+                continue
+            self.logger.debug(response)
+
+            if not isinstance(response.get('data'), list) or len(response['data']) != len(chunk):
+                error_msg = response.get('error_msg') or 'Invalid response to batch request %s' % endpoint
+                results.extend({'success': False, 'error_msg': error_msg} for payload in chunk)
+                continue
+            results.extend(response['data'])
+        return results
+
     def prepare_cover_storage(self, qt_book_id, qt_cover_filename, replace_file=False):
         self.logger.debug(sys._getframe().f_code.co_name)
 
@@ -171,14 +336,14 @@ class ApiClient():
             'filename': qt_filename_base,
             'format': qt_filename_ext
         }
-        json_data = json.dumps(qt_payload, sort_keys=True,indent=4, separators=(',', ': '))
+        json_data = json.dumps(qt_payload, separators=(',', ':'))
         self.logger.debug(json_data)
 
         response = RequestManager.create_request('POST', '/storage/prepare/cover', json_data=json_data)
         self.logger.debug(response)
         return response
 
-    def upload_bookstorage(self, signed_url, local_filepath):
+    def upload_bookstorage(self, signed_url, local_file):
         self.logger.debug(sys._getframe().f_code.co_name)
 
         # response = RequestManager.create_file_request("/storage/upload/book", {'source':'calibre'},
@@ -191,8 +356,104 @@ class ApiClient():
         #                                           {"file": local_filepath}
         #                                           #{'file':'/home/jason/Documents/Daulton, John/Galactic Mage, The/Galactic Mage, The - John Daulton.mobi'}
         #                                           )
-        response = RequestManager.create_signed_file_request(signed_url, local_filepath)
+        response = RequestManager.create_signed_file_request(signed_url, local_file)
+
+        self.logger.debug(response)
+        return response
+
+    def upload_bookstorage_multipart(self, qt_storage_metadata, local_file, journal=None):
+        '''
+        This function will upload a large book to QuietThyme storage as prefs['multipart_part_size']
+        byte parts, prefs['multipart_concurrency'] parts at the same time. Completed parts are
+        recorded in an UploadJournal, so an interrupted upload resumes from the missing parts.
+        :param local_file: the filepath, or an open FileSource, of the book.
+        :return: the quietthyme book_data for the uploaded book, or None if QuietThyme does not
+                 support multipart uploads.
+        '''
+        self.logger.debug(sys._getframe().f_code.co_name)
+
+        # every part is a slice of the same memory mapping.
+        with file_source(local_file) as source:
+            return self._upload_bookstorage_parts(qt_storage_metadata, source, journal)
+
+    def _upload_bookstorage_parts(self, qt_storage_metadata, source, journal=None):
+        journal = journal or UploadJournal()
+        key = UploadJournal.key(qt_storage_metadata['storage_id'], qt_storage_metadata['book_id'], source,
+                                qt_storage_metadata.get('storage_hash'))
+        entry = journal.get(key)
+
+        size = len(source)
+        part_size = entry['part_size'] if entry else prefs['multipart_part_size']
+        part_count = max(1, (size + part_size - 1) // part_size)
+
+        qt_multipart_data = self.prepare_bookstorage_multipart(qt_storage_metadata, part_size, part_count,
+                                                               upload_id=entry['upload_id'] if entry else None)
+        if qt_multipart_data is None:
+            return None
+        upload_id = qt_multipart_data['upload_id']
+        if entry is None or entry['upload_id'] != upload_id:
+            # QuietThyme could not resume the earlier upload (or there was none), start over.
+            journal.start(key, upload_id, part_size)
+            entry = journal.get(key)
+        else:
+            self.logger.info('Resuming upload of %s, %d of %d parts already uploaded' % (source.filepath, len(entry['parts']), part_count))
+
+        etags = dict((int(part_number), etag) for part_number, etag in entry['parts'].items())
+
+        def upload_part(part_number):
+            offset = (part_number - 1) * part_size
+            length = min(part_size, size - offset)
+            part_url = qt_multipart_data['part_urls'][part_number - 1]
+            etag = RequestManager.create_signed_part_request(part_url, source, offset, length)
+            journal.record_part(key, part_number, etag)
+            return etag
+
+        missing = [part_number for part_number in range(1, part_count + 1) if part_number not in etags]
+        for part_number, etag in zip(missing, WorkerPool(prefs['multipart_concurrency']).map(upload_part, missing)):
+            etags[part_number] = etag
+
+        response = self.complete_bookstorage_multipart(qt_storage_metadata['book_id'], upload_id,
+            [{'part_number': part_number, 'etag': etags[part_number]} for part_number in sorted(etags)])
+        if not response.get('success'):
+            # keep the journal, the uploaded parts can still be completed on the next attempt.
+            raise RequestError(response.get('error_msg') or 'Could not complete upload of %s' % source.filepath)
+        journal.remove(key)
+        return qt_multipart_data['book_data']
+
+    def prepare_bookstorage_multipart(self, qt_storage_metadata, part_size, part_count, upload_id=None):
+        '''
+        This function will request a multipart upload and a signed url for every part. When
+        upload_id is given QuietThyme is asked to resume that upload, it may start a new one instead.
+        :return: dict with book_data, upload_id and part_urls, or None if multipart uploads are not supported.
+        '''
+        self.logger.debug(sys._getframe().f_code.co_name)
+
+        qt_payload = dict(qt_storage_metadata, part_size=part_size, part_count=part_count)
+        if upload_id:
+            qt_payload['upload_id'] = upload_id
+        json_data = json.dumps(qt_payload, separators=(',', ':'))
+
+        try:
+            response = RequestManager.create_request('POST', '/storage/prepare/book/multipart', json_data=json_data)
+        except RequestError, e:
+            self.logger.warning('Could not prepare multipart upload: %s' % e)
+            return None
+        self.logger.debug(response)
+        if not response.get('success'):
+            return None
+        return response['data']
+
+    def complete_bookstorage_multipart(self, qt_book_id, upload_id, parts):
+        self.logger.debug(sys._getframe().f_code.co_name)
 
+        qt_payload = {
+            'book_id': qt_book_id,
+            'upload_id': upload_id,
+            'parts': parts
+        }
+        json_data = json.dumps(qt_payload, separators=(',', ':'))
+
+        response = RequestManager.create_request('POST', '/storage/complete/book/multipart', json_data=json_data)
         self.logger.debug(response)
         return response
 
@@ -208,23 +469,71 @@ class ApiClient():
     def destroy_book(self, calibre_storage_path):
         self.logger.debug(sys._getframe().f_code.co_name)
 
-        import re
-        pattern = r"(?P<storage_type>\S+)://(?P<book_id>\S+)/(?P<file_name>\D+)"
-        parsed_data = re.search(pattern, calibre_storage_path).groupdict()
-
-        response = RequestManager.create_request('DELETE', '/book/' + parsed_data['book_id'])
+        response = RequestManager.create_request('DELETE', '/book/' + StoragePath.parse(calibre_storage_path).book_id)
         self.logger.debug(response)
         return response
 
+    def destroy_books(self, calibre_storage_paths, callback=None):
+        '''
+        This function will delete many books at once, in chunks of prefs['batch_size'] books per
+        request. If QuietThyme does not support batch requests the books are deleted one at a time,
+        prefs['delete_concurrency'] books at the same time. A book that can not be deleted does not
+        stop the others.
+        :param callback: optional callable, called as callback(completed, total) as books are deleted.
+        :return: an error_msg for every path, in order. error_msg is None on success.
+        '''
+        self.logger.debug(sys._getframe().f_code.co_name)
+
+        errors = [None] * len(calibre_storage_paths)
+        book_ids = []
+        for i, path in enumerate(calibre_storage_paths):
+            try:
+                book_ids.append((i, StoragePath.parse(path).book_id))
+            except ValueError, e:
+                errors[i] = str(e)
+        if not book_ids:
+            # nothing to delete, and callback is never called with a total of 0.
+            return errors
+
+        results = self._batch_request('/book/delete/batch', [{'book_id': book_id} for i, book_id in book_ids])
+        if results is None:
+            results = WorkerPool(prefs['delete_concurrency']).map(self._destroy_book_id, [book_id for i, book_id in book_ids], callback)
+        else:
+            results = [None if result.get('success') else result.get('error_msg', 'Unknown error') for result in results]
+            if callback:
+                callback(len(book_ids), len(book_ids))
+        for (i, book_id), error_msg in zip(book_ids, results):
+            errors[i] = error_msg
+        return errors
+
+    def _destroy_book_id(self, book_id):
+        try:
+            response = RequestManager.create_request('DELETE', '/book/' + book_id)
+        except RequestError, e:
+            return str(e)
+        self.logger.debug(response)
+        if not response.get('success'):
+            return response.get('error_msg', 'Could not delete book %s' % book_id)
+        return None
+
     def download_bookstorage(self, calibre_storage_path):
         self.logger.debug(sys._getframe().f_code.co_name)
-        import re
-        pattern = r"(?P<storage_type>\S+)://(?P<book_id>\S+)/(?P<file_name>\D+)"
-        parsed_data = re.search(pattern, calibre_storage_path).groupdict()
 
-        url_response =  RequestManager.create_request('GET', '/storage/' + parsed_data['book_id'], json_response=True)
+        url_response =  RequestManager.create_request('GET', '/storage/' + StoragePath.parse(calibre_storage_path).book_id, json_response=True)
         # unfortunaly the API cant do the redirect for us, so we need to start a new request using the url param.
         self.logger.debug(url_response)
         return RequestManager.create_request('GET', url_response['data']['url'], json_response=False, allow_redirects=True, external_request=True)
 
+    def download_bookstorage_to(self, calibre_storage_path, outfile, progress=None):
+        '''
+        This function will stream a book from QuietThyme storage into outfile, in fixed size chunks.
+        :param progress: optional callable, called as progress(bytes_written, total_bytes)
+        :return: the number of bytes written
+        '''
+        self.logger.debug(sys._getframe().f_code.co_name)
+
+        url_response =  RequestManager.create_request('GET', '/storage/' + StoragePath.parse(calibre_storage_path).book_id, json_response=True)
+        self.logger.debug(url_response)
+        return RequestManager.create_download_request(url_response['data']['url'], outfile, progress=progress)
+
 
@@ -0,0 +1,113 @@
+import errno
+import httplib
+import socket
+import threading
+import logging
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
+__docformat__ = 'restructuredtext en'
+
+logger = logging.getLogger(__name__)
+
+# methods that can be sent again even if the server may have processed them already.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+class ConnectionPool(object):
+    '''
+    A thread-safe pool of keep-alive httplib connections, keyed by (scheme, host).
+
+    Connections are handed out with :meth:`request` and must be given back with
+    :meth:`release` once the response has been read. A connection is only
+    returned to the pool if its response was fully consumed and the server did
+    not ask for it to be closed, otherwise it is thrown away.
+    '''
+
+    def __init__(self, maxsize=8, timeout=60):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def request(self, scheme, host, method, path, body=None, headers=None):
+        '''
+        Send a request over a pooled connection.
+
+        If a reused connection turns out to have been closed by the server while
+        it sat idle, the request is transparently retried once on a fresh
+        connection. Requests with a non-idempotent method are only retried when
+        the server can not have processed them: the request could not be sent,
+        or the connection was closed or reset before any response was read.
+        :return: (connection, response) tuple. Pass both to :meth:`release`.
+        '''
+        headers = headers or {}
+        conn, reused = self._acquire(scheme, host)
+        sent = False
+        try:
+            conn.request(method, path, body, headers)
+            sent = True
+            return conn, conn.getresponse()
+        except (httplib.BadStatusLine, httplib.CannotSendRequest, httplib.ResponseNotReady, socket.error), e:
+            conn.close()
+            if not reused or not (method in IDEMPOTENT_METHODS or not sent or self._closed_before_response(e)):
+                raise
+            logger.debug('Pooled connection to %s went stale, reconnecting' % host)
+
+        if hasattr(body, 'seek'):
+            body.seek(0)
+        conn = self._new_connection(scheme, host)
+        try:
+            conn.request(method, path, body, headers)
+            return conn, conn.getresponse()
+        except:
+            conn.close()
+            raise
+
+    def release(self, conn, response=None):
+        '''
+        Give a connection back to the pool, or close it if it cannot be reused.
+        '''
+        if response is None or not response.isclosed() or response.will_close:
+            conn.close()
+            return
+
+        with self._lock:
+            idle = self._idle.setdefault(conn.pool_key, [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        '''
+        Close every idle connection held by the pool.
+        '''
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.itervalues():
+            for conn in conns:
+                conn.close()
+
+    @staticmethod
+    def _closed_before_response(error):
+        # the first read of a stale connection finds it closed (an empty status line) or reset. Anything else,
+        # like a timeout or a garbled status line, may come after the server processed the request.
+        if isinstance(error, httplib.BadStatusLine):
+            return error.line == "''" or error.line.startswith('No status line received')
+        return isinstance(error, socket.error) and error.errno in (errno.ECONNRESET, errno.EPIPE)
+
+    def _acquire(self, scheme, host):
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+        return self._new_connection(scheme, host), False
+
+    def _new_connection(self, scheme, host):
+        logger.debug('Opening new %s connection to %s' % (scheme, host))
+        if scheme == 'http':
+            conn = httplib.HTTPConnection(host, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPSConnection(host, timeout=self.timeout)
+        conn.pool_key = (scheme, host)
+        return conn
@@ -0,0 +1,73 @@
+import time
+import socket
+import urlparse
+import threading
+import logging
+from calibre_plugins.quietthyme.config import prefs
+from calibre_plugins.quietthyme.client.workerpool import BackgroundTask
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
+__docformat__ = 'restructuredtext en'
+
+logger = logging.getLogger(__name__)
+
+class ConnectivityMonitor(object):
+    '''
+    Tracks whether the QuietThyme API host can be reached, without ever blocking the caller.
+
+    is_online() answers from the result of the last probe, and starts a new probe on a
+    background thread once that result is older than ttl seconds. While the host is
+    unreachable probes back off exponentially, from min_backoff up to max_backoff
+    seconds, so an offline machine is not probed on every poll. Until the first probe
+    completes the host is reported offline.
+    '''
+
+    def __init__(self, probe=None, ttl=60.0, min_backoff=2.0, max_backoff=300.0, timeout=5.0):
+        # probe() returns True if the host is reachable. By default it opens a TCP connection to the API host.
+        self.probe = probe or self._connect_api_host
+        self.ttl = ttl
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._online = False
+        self._failures = 0
+        self._next_probe = 0
+        self._probe_task = None
+
+    def is_online(self, force_refresh=False):
+        '''
+        Return the last known connectivity, and start a background probe if it has expired.
+        :param force_refresh: probe again now, even if the last result has not expired.
+        '''
+        with self._lock:
+            if (force_refresh or time.time() >= self._next_probe) and self._probe_task is None:
+                self._probe_task = BackgroundTask(self._run_probe)
+            return self._online
+
+    def _run_probe(self):
+        try:
+            online = bool(self.probe())
+        except Exception, e:
+            logger.debug('Connectivity probe failed: %s' % e)
+            online = False
+        with self._lock:
+            if online:
+                self._failures = 0
+                self._next_probe = time.time() + self.ttl
+            else:
+                if self._online or self._failures == 0:
+                    logger.warn('Not connected to the internet, cannot open Quietthyme plugin')
+                self._next_probe = time.time() + min(self.max_backoff, self.min_backoff * 2 ** self._failures)
+                self._failures += 1
+            self._online = online
+            self._probe_task = None
+        return online
+
+    def _connect_api_host(self):
+        schema, domain = urlparse.urlparse(prefs['api_base'])[:2]
+        host, _, port = domain.partition(':')
+        port = int(port) if port else (443 if schema == 'https' else 80)
+        socket.create_connection((host, port), self.timeout).close()
+        return True
@@ -0,0 +1,119 @@
+import os
+import mmap
+import hashlib
+import logging
+from contextlib import contextmanager
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
+__docformat__ = 'restructuredtext en'
+
+logger = logging.getLogger(__name__)
+
+class FileSource(object):
+    '''
+    A read only, memory mapped view of a local file, shared by the upload paths.
+
+    The file is opened and mapped once. Uploads read it through slices, which
+    hand out zero-copy buffers of the mapping instead of copying it through a
+    file object, and hashing is a single pass over the same mapping. Use it as a
+    context manager so the mapping and the file descriptor are always closed.
+    '''
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._file = open(filepath, 'rb')
+        try:
+            self.size = os.fstat(self._file.fileno()).st_size
+            # empty files can not be mapped.
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        except:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def view(self, offset, length):
+        '''
+        Return a zero-copy buffer of length bytes of the file, starting at offset. Past the end of
+        the file an empty string is returned, like a file read at EOF.
+        '''
+        length = max(0, min(length, self.size - offset))
+        if self._mmap is None or length == 0:
+            return ''
+        return buffer(self._mmap, offset, length)
+
+    def slice(self, offset=0, length=None):
+        '''
+        Return a file like reader of length bytes (by default the rest of the file), starting at
+        offset. Slices are independent, so several parts can be read by concurrent threads.
+        '''
+        if length is None:
+            length = self.size - offset
+        return FileSourceSlice(self, offset, length)
+
+    def hash(self, algorithm='sha1', chunk_size=1024 * 1024):
+        '''
+        Return the hex digest of the file contents.
+        '''
+        content_hash = hashlib.new(algorithm)
+        for offset in range(0, self.size, chunk_size):
+            content_hash.update(self.view(offset, chunk_size))
+        return content_hash.hexdigest()
+
+@contextmanager
+def file_source(local_file):
+    '''
+    Context manager that yields a FileSource for local_file, which is either a filepath or an
+    open FileSource. Only a FileSource opened here is closed on exit.
+    '''
+    if isinstance(local_file, FileSource):
+        yield local_file
+        return
+    with FileSource(local_file) as source:
+        yield source
+
+class FileSourceSlice(object):
+    '''
+    A read only, file like view of part of a FileSource, used as a request body.
+    '''
+
+    def __init__(self, source, offset, length):
+        self.source = source
+        self.offset = offset
+        self.length = length
+        self.position = 0
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        remaining = self.length - self.position
+        if size < 0 or size > remaining:
+            size = remaining
+        data = self.source.view(self.offset + self.position, size)
+        self.position += len(data)
+        return data
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self.position
+        elif whence == os.SEEK_END:
+            position += self.length
+        self.position = max(0, min(position, self.length))
+
+    def tell(self):
+        return self.position
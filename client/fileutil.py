@@ -0,0 +1,36 @@
+import os
+import errno
+import logging
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
+__docformat__ = 'restructuredtext en'
+
+logger = logging.getLogger(__name__)
+
+def ensure_dir(path):
+    '''
+    Create the directory path (and its parents), unless it already exists.
+    '''
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+def atomic_write(path, data):
+    '''
+    Replace the contents of the file at path with data, creating its directory if needed. The data
+    is written to a temporary file that is renamed over path, so a crash never leaves a half
+    written file behind.
+    '''
+    ensure_dir(os.path.dirname(path))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # windows will not rename over an existing file.
+        os.remove(path)
+        os.rename(tmp_path, path)
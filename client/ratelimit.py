@@ -0,0 +1,108 @@
+import time
+import threading
+import logging
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
+__docformat__ = 'restructuredtext en'
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket(object):
+    '''
+    A thread safe token bucket rate limiter. Tokens are added at rate per second, up to
+    capacity, and every request takes one token (waiting for it if necessary). A rate of
+    0 (or less) disables the limit. Tokens can also be bytes, to limit bandwidth.
+    '''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = time.time()
+
+    def acquire(self, tokens=1):
+        if self.rate <= 0:
+            return
+        # take more than a full bucket one bucket at a time, so large requests are not starved.
+        while tokens > self.capacity:
+            self.acquire(self.capacity)
+            tokens -= self.capacity
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+class AdaptiveConcurrency(object):
+    '''
+    Limits the number of requests in flight, and adapts the limit with AIMD (additive increase,
+    multiplicative decrease), like TCP congestion control.
+
+    While responses are successful and their latency stays within latency_tolerance times the
+    best latency seen, the limit grows by about one for every limit requests. A throttled (429,
+    503) or failed request halves the limit, at most once per backoff_interval seconds so a burst
+    of failures from the same window only counts once.
+    '''
+
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=32, latency_tolerance=2.0, backoff_interval=1.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff_interval = backoff_interval
+        self._condition = threading.Condition(threading.Lock())
+        self._in_flight = 0
+        self._min_latency = None
+        self._last_decrease = 0
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, latency=None, status=None):
+        '''
+        :param latency: seconds until the response was received.
+        :param status: the HTTP status of the response, None if no response was received.
+        '''
+        with self._condition:
+            self._in_flight -= 1
+            if status is None or status == 429 or status >= 500:
+                now = time.time()
+                if now - self._last_decrease >= self.backoff_interval:
+                    self._last_decrease = now
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    logger.debug('Request concurrency reduced to %d' % self.limit)
+            elif latency is not None:
+                # the best latency slowly drifts up, so one unusually fast response is forgotten.
+                self._min_latency = latency if self._min_latency is None else min(latency, self._min_latency * 1.05)
+                if latency <= self._min_latency * self.latency_tolerance:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+class ThrottledReader(object):
+    '''
+    A file like wrapper that takes a token from token_bucket for every byte read, so a request
+    body is sent no faster than the bucket allows.
+    '''
+
+    def __init__(self, f, token_bucket):
+        self.f = f
+        self.token_bucket = token_bucket
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        if data:
+            self.token_bucket.acquire(len(data))
+        return data
+
+    def seek(self, *args):
+        return self.f.seek(*args)
@@ -1,7 +1,6 @@
 import mimetools
 import mimetypes
 import io
-import codecs
 import urllib
 import urlparse
 import httplib
@@ -9,7 +8,14 @@ import socket
 import sys
 import json
 import os
+import threading
+import time
+import zlib
 from calibre_plugins.quietthyme.config import prefs
+from calibre_plugins.quietthyme.client.connectionpool import ConnectionPool
+from calibre_plugins.quietthyme.client.retry import RetryPolicy, CircuitBreaker, RequestError, parse_retry_after
+from calibre_plugins.quietthyme.client.ratelimit import TokenBucket, AdaptiveConcurrency, ThrottledReader
+from calibre_plugins.quietthyme.client.filesource import FileSource, file_source
 import logging
 
 __license__   = 'GPL v3'
@@ -20,11 +26,44 @@ logger = logging.getLogger(__name__)
 
 class RequestManager(object):
 
+    # keep-alive connections shared by every ApiClient call, so that we only pay for the TCP/TLS handshake once per host.
+    pool = ConnectionPool()
+
+    # failed requests are retried with backoff. Creating books is find-or-create, and preparing storage
+    # only hands out signed urls, so those POST endpoints are safe to repeat.
+    retry_policy = RetryPolicy(idempotent_endpoints=[
+        ('POST', '/book'),
+        ('POST', '/book/batch'),
+        ('POST', '/storage/prepare/book'),
+        ('POST', '/storage/prepare/book/batch'),
+        ('POST', '/storage/prepare/book/multipart'),
+        ('POST', '/storage/prepare/cover')
+    ])
+
+    # a CircuitBreaker per host, so an outage of QuietThyme or a storage provider fails fast.
+    circuit_breakers = {}
+    _circuit_breakers_lock = threading.Lock()
+
+    # a (TokenBucket, AdaptiveConcurrency) pair per endpoint class: 'api' for the QuietThyme API and
+    # 'storage' for signed storage urls, which are served by the storage providers.
+    rate_limiters = {}
+    _rate_limiters_lock = threading.Lock()
+
+    # byte rate TokenBuckets shared by all concurrent transfers, by direction ('upload' or 'download').
+    bandwidth_limiters = {}
+
     @classmethod
     def create_request(cls, action, endpoint='/', query_args=None, json_data='', json_response=True, allow_redirects=False, redirect_depth=0, external_request=False):
+        '''
+        Send a request to the QuietThyme API (or an external url), retrying transient failures.
+
+        :return: the decoded json response, or the response body if json_response is False.
+        :raises RequestError: if the request failed.
+        '''
         logger.debug(sys._getframe().f_code.co_name)
 
-        headers = {}
+        # listings and metadata are very compressible, ask for a compressed response.
+        headers = {'Accept-Encoding': 'gzip, deflate'}
 
         if not query_args:
             query_args = {}
@@ -33,12 +72,17 @@ class RequestManager(object):
         if action == 'GET' and allow_redirects and (redirect_depth > 0 or external_request):
             # we're  currently redirecting, dont mess with url or headers.
             if redirect_depth > 10:
-                raise Exception("Redirected "+redirect_depth+" times, giving up.")
+                raise RequestError("Redirected %d times, giving up." % redirect_depth)
             url = endpoint
+            endpoint_class = 'storage'
         else:
             url = prefs['api_base'] + endpoint
+            endpoint_class = 'api'
 
             if json_data:
+                if prefs['compress_requests'] and len(json_data) >= prefs['compress_requests_min_size']:
+                    json_data = cls._gzip(json_data)
+                    headers['Content-Encoding'] = 'gzip'
                 clen = len(json_data)
                 headers['Content-Type'] = 'application/json'
                 headers['Content-Length'] = clen
@@ -53,48 +97,147 @@ class RequestManager(object):
             encoded_args = urllib.urlencode(query_args)
             path += "?" + encoded_args
 
-        logger.info('Requesting url: %s %s %s %s' % (action, schema, domain, path))
-        try:
-
-            http = httplib.HTTPSConnection(domain)
-            http.connect()
-            http.request(action, path, json_data or None, headers)
-
+        def send():
+            logger.info('Requesting url: %s %s %s %s' % (action, schema, domain, path))
+            http, r = cls._send(schema, domain, action, path, json_data or None, headers, endpoint_class)
             try:
-                r = http.getresponse()
                 location_header = r.getheader('Location')
                 if r.status == 200:
                     logger.info('Request successful (%s): %s' % (r.status, r.reason))
 
-                    if json_response:
-                        data = r.read()
-                        logger.debug(data)
-                        return json.loads(data)
-                    else:
-                        return r.read()
+                    data = cls._read_body(r)
+                    if not json_response:
+                        return data, None
+                    logger.debug(data)
+                    try:
+                        return json.loads(data), None
+                    except ValueError:
+                        raise RequestError('Invalid JSON response from %s' % url, r.status)
                 elif (r.status == 301 or r.status == 302) and allow_redirects and (location_header != url):
                     logger.info("Redirecting to another url, and continuing request.")
-                    return RequestManager.create_request('GET', location_header, json_response=json_response, allow_redirects=True, redirect_depth = (redirect_depth +1))
+                    r.read()
+                    return None, location_header
                 elif r.status == 401: #or r.status == 403:
                     logger.warning("Recieved a 401/403 response from QuietThyme API. This token is no longer valid.")
                     prefs.pop("token", None)
-                    logger.warning('Request create_request failed %s (%s): %s' % (url, r.status, r.reason))
-                    logger.error('Response headers: %s' % r.getheaders())
-                else:
-                    logger.warning('Request create_request failed %s (%s): %s' % (url, r.status, r.reason))
-                    logger.error('Response headers: %s' % r.getheaders())
-            except Exception, e:
-                logger.error(e)
+                raise cls._response_error(url, r)
             finally:
-                logger.debug('Closing http request')
-                http.close()
+                logger.debug('Releasing http connection')
+                cls.pool.release(http, r)
+
+        data, redirect_location = cls.retry_policy.call(action, endpoint, send, cls.circuit_breaker(domain))
+        if redirect_location:
+            return RequestManager.create_request('GET', redirect_location, json_response=json_response, allow_redirects=True, redirect_depth = (redirect_depth +1))
+        return data
+
+    @classmethod
+    def circuit_breaker(cls, host):
+        with cls._circuit_breakers_lock:
+            if host not in cls.circuit_breakers:
+                cls.circuit_breakers[host] = CircuitBreaker()
+            return cls.circuit_breakers[host]
+
+    @classmethod
+    def rate_limiter(cls, endpoint_class):
+        '''
+        Return the (TokenBucket, AdaptiveConcurrency) tuple of an endpoint class. Each of them is
+        rebuilt when its preference changes.
+        '''
+        rate = prefs['%s_requests_per_second' % endpoint_class]
+        max_limit = prefs['%s_max_concurrency' % endpoint_class]
+        with cls._rate_limiters_lock:
+            token_bucket, concurrency = cls.rate_limiters.get(endpoint_class, (None, None))
+            if token_bucket is None or token_bucket.rate != rate:
+                token_bucket = TokenBucket(rate)
+            if concurrency is None or concurrency.max_limit != max_limit:
+                concurrency = AdaptiveConcurrency(max_limit=max_limit)
+            cls.rate_limiters[endpoint_class] = (token_bucket, concurrency)
+            return token_bucket, concurrency
+
+    @classmethod
+    def bandwidth_limiter(cls, direction):
+        '''
+        Return the TokenBucket for prefs['max_<direction>_rate'] bytes per second, or None if the
+        rate is not limited. The bucket is rebuilt when the preference changes.
+        '''
+        rate = prefs['max_%s_rate' % direction]
+        with cls._rate_limiters_lock:
+            token_bucket = cls.bandwidth_limiters.get(direction)
+            if token_bucket is None or token_bucket.rate != rate:
+                token_bucket = cls.bandwidth_limiters[direction] = TokenBucket(rate)
+        return token_bucket if rate > 0 else None
+
+    @classmethod
+    def _throttled_body(cls, body):
+        token_bucket = cls.bandwidth_limiter('upload')
+        return ThrottledReader(body, token_bucket) if token_bucket else body
+
+    @classmethod
+    def _send(cls, schema, domain, method, path, body=None, headers=None, endpoint_class='storage'):
+        # send a request over the pool, within the rate and concurrency limits of its endpoint class.
+        # Network errors are reported as a RequestError without a status.
+        token_bucket, concurrency = cls.rate_limiter(endpoint_class)
+        concurrency.acquire()
+        status = None
+        # streamed bodies (book and cover uploads) take as long as their size, not the server, so
+        # their latency is not sampled. Their status still counts.
+        sample_latency = body is None or isinstance(body, basestring)
+        try:
+            token_bucket.acquire()
+            start = time.time()
+            http, r = cls.pool.request(schema, domain, method, path, body, headers)
+            status = r.status
+            return http, r
+        except (socket.error, httplib.HTTPException), e:
+            logger.error('Error: %s' % e)
+            raise RequestError('Could not connect to %s: %s' % (domain, e))
+        finally:
+            # the slot is held until the response headers arrive, which is what the latency measures.
+            concurrency.release(time.time() - start if status is not None and sample_latency else None, status)
+
+    @classmethod
+    def _read_body(cls, r):
+        # read the response body, undoing a gzip or deflate Content-Encoding.
+        data = r.read()
+        encoding = (r.getheader('Content-Encoding') or '').strip().lower()
+        try:
+            if encoding in ('gzip', 'x-gzip'):
+                return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+            if encoding == 'deflate':
+                try:
+                    return zlib.decompress(data)
+                except zlib.error:
+                    # some servers send a raw deflate stream, without the zlib header.
+                    return zlib.decompress(data, -zlib.MAX_WBITS)
+        except zlib.error, e:
+            raise RequestError('Invalid %s encoded response: %s' % (encoding, e), r.status)
+        return data
 
-        except socket.error, e:
-            logger.error("Error:", str(e))
-            raise SystemExit(1)
+    @classmethod
+    def _gzip(cls, data):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
 
     @classmethod
-    def create_signed_file_request(self, url, filepath, json_response=False):
+    def _response_error(cls, url, r):
+        # read the failed response and describe it with a RequestError.
+        logger.warning('Request failed %s (%s): %s' % (url, r.status, r.reason))
+        logger.error('Response headers: %s' % r.getheaders())
+        message = '%s (%s)' % (r.reason, r.status)
+        try:
+            message = json.loads(cls._read_body(r)).get('error_msg') or message
+        except (ValueError, AttributeError, RequestError):
+            pass
+        return RequestError(message, r.status, parse_retry_after(r.getheader('Retry-After')))
+
+    @classmethod
+    def create_signed_file_request(self, url, local_file, json_response=False):
+        '''
+        PUT a file to a signed storage url, retrying transient failures.
+
+        :param local_file: the filepath, or an open FileSource, of the file.
+        :raises RequestError: if the upload failed.
+        '''
         logger.debug(sys._getframe().f_code.co_name)
 
         headers = {
@@ -102,38 +245,139 @@ class RequestManager(object):
             "Accept": "text/plain"
         }
 
+        # signed urls are ascii, but come from a json response as unicode. httplib can not join a unicode
+        # request line with the byte string headers above.
         schema, domain, path, params, query, fragments = \
-            urlparse.urlparse(url)
+            urlparse.urlparse(str(url))
 
         if query:
             path += "?" + query
 
         logger.debug("Upload URL: %s" % (path))
-        http = httplib.HTTPSConnection(domain)
-        http.request("PUT", path, open(filepath, "rb"), headers)
 
+        def send():
+            with file_source(local_file) as source:
+                # httplib can not size a slice (or a throttled body) by itself.
+                headers["Content-Length"] = str(len(source))
+                http, r = self._send(schema, domain, "PUT", path, self._throttled_body(source.slice()), headers)
 
-        try:
-            r = http.getresponse()
-            if r.status == 200:
+            try:
+                if r.status != 200:
+                    raise self._response_error(url, r)
                 logger.debug('Request create_signed_file_request successful (%s): %s' % (r.status, r.reason))
 
+                data = r.read()
                 if json_response:
-                    data = r.read()
                     logger.debug(data)
                     return json.loads(data)
-                else:
-                    return r.read()
+                return data
+            finally:
+                logger.debug('Releasing http connection')
+                self.pool.release(http, r)
+
+        return self.retry_policy.call("PUT", path, send, self.circuit_breaker(domain))
+
+    @classmethod
+    def create_signed_part_request(cls, url, source, offset, length):
+        '''
+        PUT length bytes of a FileSource, starting at offset, to a signed part upload url.
+
+        :return: the ETag QuietThyme storage assigned to the part.
+        :raises RequestError: if the upload failed.
+        '''
+        logger.debug(sys._getframe().f_code.co_name)
+
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(length)
+        }
+
+        schema, domain, path, params, query, fragments = \
+            urlparse.urlparse(url)
+
+        if query:
+            path += "?" + query
+
+        logger.debug("Upload part URL: %s (%d bytes at %d)" % (path, length, offset))
+
+        def send():
+            http, r = cls._send(schema, domain, "PUT", path, cls._throttled_body(source.slice(offset, length)), headers)
+
+            try:
+                if r.status != 200:
+                    raise cls._response_error(url, r)
+                r.read()
+                return r.getheader('ETag')
+            finally:
+                logger.debug('Releasing http connection')
+                cls.pool.release(http, r)
+
+        return cls.retry_policy.call("PUT", path, send, cls.circuit_breaker(domain))
+
+    @classmethod
+    def create_download_request(cls, url, outfile, chunk_size=64 * 1024, progress=None, redirect_depth=0):
+        '''
+        Download url (following redirects) straight into outfile, in chunk_size pieces, so the
+        whole file is never held in memory. The download rate is limited by prefs['max_download_rate'].
+
+        :param outfile: file like object the response body is written to.
+        :param progress: optional callable, called as progress(bytes_written, total_bytes) after
+                         every chunk. total_bytes is None when the server does not send a Content-Length.
+        :return: the number of bytes written.
+        :raises RequestError: if the download failed. Nothing is retried, outfile may already
+                              hold part of the body.
+        '''
+        logger.debug(sys._getframe().f_code.co_name)
+
+        if redirect_depth > 10:
+            raise RequestError("Redirected %d times, giving up." % redirect_depth)
+
+        schema, domain, path, params, query, fragments = \
+            urlparse.urlparse(url)
+
+        if query:
+            path += "?" + query
+
+        logger.info('Downloading url: %s %s %s' % (schema, domain, path))
+        circuit_breaker = cls.circuit_breaker(domain)
+        circuit_breaker.before_request()
+        success = False
+        try:
+            http, r = cls._send(schema, domain, 'GET', path)
+            success = r.status < 500
+        finally:
+            circuit_breaker.record_result(success)
+
+        redirect_location = None
+        try:
+            if r.status == 200:
+                content_length = r.getheader('Content-Length')
+                total = int(content_length) if content_length else None
+                written = 0
+                token_bucket = cls.bandwidth_limiter('download')
+                while True:
+                    chunk = r.read(chunk_size)
+                    if not chunk:
+                        break
+                    if token_bucket:
+                        token_bucket.acquire(len(chunk))
+                    outfile.write(chunk)
+                    written += len(chunk)
+                    if progress:
+                        progress(written, total)
+                logger.info('Download successful (%s): %d bytes' % (r.status, written))
+                return written
+            elif r.status == 301 or r.status == 302:
+                r.read()
+                redirect_location = r.getheader('Location')
             else:
-                logger.error('Request create_signed_file_request failed (%s): %s' % (r.status, r.reason))
-                logger.error('Response headers: %s' % r.getheaders())
-                logger.error('Response data: %s' % r.read())
-        except Exception, e:
-            logger.error(e)
+                raise cls._response_error(url, r)
         finally:
-            logger.debug('Closing http request')
-            http.close()
+            logger.debug('Releasing http connection')
+            cls.pool.release(http, r)
 
+        logger.info("Redirecting to another url, and continuing download.")
+        return cls.create_download_request(redirect_location, outfile, chunk_size, progress, redirect_depth + 1)
 
     #from https://github.com/kovidgoyal/calibre/blob/ef09e886b3d95d6de5c76ad3a179694ae75c65f4/setup/pypi.py#L235
     @classmethod
@@ -143,6 +387,7 @@ class RequestManager(object):
         :param form_fields: simple key value form fields. key=fieldname, value=fieldvalue
         :param filepath_fields: key=fieldname, value=filepath for file that will be uploaded
         :return: response
+        :raises RequestError: if the request failed.
         """
         logger.debug(sys._getframe().f_code.co_name)
         if not query_args:
@@ -156,55 +401,65 @@ class RequestManager(object):
         for key, value in form_fields.iteritems():
             form.add_field(key, str(value))
 
-        # Add a fake file
-        for key, filepath in filepath_fields.iteritems():
-            if os.path.isfile(filepath):
-                form.add_file(key, os.path.basename(filepath),
-                              fileHandle=codecs.open(filepath, "rb"))
-                #fileHandle=StringIO('FILE CONTENTS'))
-            else:
-                raise Exception("The file was not found")
-
         # Build the request
         url = prefs['api_base'] + endpoint
-        schema, netloc, url, params, query, fragments = \
+        schema, netloc, path, params, query, fragments = \
             urlparse.urlparse(url)
 
         if query_args:
             encoded_args = urllib.urlencode(query_args)
-            url += "?" + encoded_args
+            path += "?" + encoded_args
 
+        # the files are streamed straight from their memory mapping into the request body.
+        sources = []
         try:
-            form_buffer = form.get_binary().getvalue()
-            http = httplib.HTTPConnection(netloc)
-            http.connect()
-            http.putrequest("POST", url)
-            http.putheader('Content-type', form.get_content_type())
-            http.putheader('Content-length', str(len(form_buffer)))
-            http.putheader('Authorization', "Bearer "+prefs['token'])
-            http.endheaders()
-            http.send(form_buffer)
-        except socket.error, e:
-            logger.error("Error:", str(e))
-            raise SystemExit(1)
-
-        r = http.getresponse()
-        if r.status == 200:
-            return json.loads(r.read())
-        else:
-            logger.error('Upload failed (%s): %s' % (r.status, r.reason))
+            for key, filepath in filepath_fields.iteritems():
+                if os.path.isfile(filepath):
+                    sources.append(FileSource(filepath))
+                    form.add_file(key, os.path.basename(filepath), fileHandle=sources[-1].slice())
+                else:
+                    raise Exception("The file was not found")
+
+            headers = {
+                'Content-Type': form.get_content_type(),
+                'Content-Length': str(form.get_content_length()),
+                'Authorization': "Bearer " + prefs['token']
+            }
+
+            def send():
+                form.seek(0)
+                http, r = cls._send(schema, netloc, "POST", path, cls._throttled_body(form), headers, 'api')
+                try:
+                    if r.status != 200:
+                        raise cls._response_error(url, r)
+                    return json.loads(r.read())
+                finally:
+                    logger.debug('Releasing http connection')
+                    cls.pool.release(http, r)
+
+            return cls.retry_policy.call("POST", endpoint, send, cls.circuit_breaker(netloc))
+        finally:
+            for source in sources:
+                source.close()
 
 
 
 #from http://pymotw.com/2/urllib2/#uploading-files
 class MultiPartForm(object):
-    """Accumulate the data to be used when posting a form."""
+    """
+    Accumulate the data to be used when posting a form.
+
+    The form is a read only, file like request body: the field blocks and the
+    attached files are streamed in chunks as httplib reads them, and the
+    Content-Length is computed up front, so files are never read into memory.
+    """
 
     def __init__(self):
         self.form_fields = []
         self.files = []
         self.boundary = mimetools.choose_boundary()
         self.logger = logger
+        self._segments = None
         return
 
     def get_content_type(self):
@@ -213,50 +468,92 @@ class MultiPartForm(object):
     def add_field(self, name, value):
         """Add a simple field to the form data."""
         self.form_fields.append((name, value))
+        self._segments = None
         return
 
     def add_file(self, fieldname, filename, fileHandle, mimetype=None):
-        """Add a file to be uploaded."""
-        #convert file to base64 file
-        import base64
-        body = fileHandle.read()
+        """
+        Add a file to be uploaded. The file is streamed from fileHandle, starting at its current
+        position, so the handle must stay open until the request is sent.
+        """
         if mimetype is None:
             mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
-        self.files.append((fieldname, filename, mimetype, body))
+        start = fileHandle.tell()
+        fileHandle.seek(0, os.SEEK_END)
+        size = fileHandle.tell() - start
+        fileHandle.seek(start)
+        self.files.append((fieldname, filename, mimetype, fileHandle, start, size))
+        self._segments = None
         return
 
+    def get_content_length(self):
+        return sum(len(segment) if isinstance(segment, str) else segment[2] for segment in self._get_segments())
+
+    def read(self, size=-1):
+        """Read up to size bytes of the encoded form, like a file."""
+        segments = self._get_segments()
+        chunks = []
+        while self._index < len(segments) and size != 0:
+            segment = segments[self._index]
+            if isinstance(segment, str):
+                remaining = len(segment) - self._offset
+                chunk = segment[self._offset:self._offset + (remaining if size < 0 else min(size, remaining))]
+            else:
+                fileHandle, start, length = segment
+                remaining = length - self._offset
+                fileHandle.seek(start + self._offset)
+                chunk = fileHandle.read(remaining if size < 0 else min(size, remaining))
+                if not chunk:
+                    raise IOError('%s is shorter than expected' % getattr(fileHandle, 'name', 'file'))
+            chunks.append(chunk)
+            self._offset += len(chunk)
+            if size >= 0:
+                size -= len(chunk)
+            if self._offset == (len(segment) if isinstance(segment, str) else segment[2]):
+                self._index += 1
+                self._offset = 0
+        if len(chunks) == 1:
+            # a single chunk (which may be a zero-copy buffer) is passed on as is.
+            return chunks[0]
+        return ''.join(str(chunk) for chunk in chunks)
+
+    def seek(self, position):
+        """Only rewinding (position 0) is supported, so a failed request can be sent again."""
+        if position != 0:
+            raise IOError('MultiPartForm can only be rewound')
+        self._get_segments()
+        self._index = 0
+        self._offset = 0
+
     def get_binary(self):
-        """Return a string representing the form data, including attached files."""
-        # Build a list of lists, each containing "lines" of the
-        # request.  Each part is separated by a boundary string.
-        # Once the list is built, return a string where each
-        # line is separated by '\r\n'.
+        """Return a BytesIO holding the whole form data, including attached files. Prefer
+        streaming the form itself, this reads every file into memory."""
+        self.seek(0)
+        binary = io.BytesIO(self.read())
+        self.seek(0)
+        return binary
+
+    def _get_segments(self):
+        # the encoded form, as a list of strings and (fileHandle, start, length) file segments.
+        if self._segments is not None:
+            return self._segments
+
+        # Each part is separated by a boundary string, and each line of the part
+        # headers by '\r\n'.
         part_boundary = '--' + self.boundary
+        blocks = []
 
-        binary = io.BytesIO()
-        needsCLRF = False
         # Add the form fields
         for name, value in self.form_fields:
-            if needsCLRF:
-                self.logger.debug('\r\n')
-                binary.write('\r\n')
-            needsCLRF = True
-
             block = [part_boundary,
                      'Content-Disposition: form-data; name="%s"' % name,
                      '',
                      value
                      ]
-            self.logger.debug('\r\n'.join(block))
-            binary.write('\r\n'.join(block))
+            blocks.append(('\r\n'.join(block), None))
 
         # Add the files to upload
-        for field_name, filename, content_type, body in self.files:
-            if needsCLRF:
-                self.logger.debug('\r\n')
-                binary.write('\r\n')
-            needsCLRF = True
-
+        for field_name, filename, content_type, fileHandle, start, size in self.files:
             block = [part_boundary,
                      str('Content-Disposition: file; name="%s"; filename="%s"' % \
                          (field_name, filename)),
@@ -264,14 +561,20 @@ class MultiPartForm(object):
                      #'Content-Transfer-Encoding: base64'
                      ''
                      ]
-            self.logger.debug('\r\n'.join(block))
-            self.logger.debug('\r\n')
-            self.logger.debug('BODY OF FILE GOES HERE')
-            binary.write('\r\n'.join(block))
-            binary.write('\r\n')
-            binary.write(body)
+            blocks.append(('\r\n'.join(block) + '\r\n', (fileHandle, start, size)))
+
+        segments = []
+        for i, (block, file_segment) in enumerate(blocks):
+            if i > 0:
+                segments.append('\r\n')
+            self.logger.debug(block)
+            segments.append(str(block))
+            if file_segment is not None:
+                segments.append(file_segment)
 
         # add closing boundary marker,
-        self.logger.debug('\r\n--' + self.boundary + '--\r\n')
-        binary.write('\r\n--' + self.boundary + '--\r\n')
-        return binary
\ No newline at end of file
+        segments.append('\r\n--' + self.boundary + '--\r\n')
+        self._segments = segments
+        self._index = 0
+        self._offset = 0
+        return segments
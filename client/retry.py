@@ -0,0 +1,167 @@
+import time
+import random
+import threading
+import logging
+from email.utils import parsedate_tz, mktime_tz
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
+__docformat__ = 'restructuredtext en'
+
+logger = logging.getLogger(__name__)
+
+class RequestError(Exception):
+    '''
+    Raised when a request to QuietThyme (or a signed storage url) fails. status is the HTTP status
+    code of the response, or None if no response was received (network error).
+    '''
+
+    def __init__(self, message, status=None, retry_after=None):
+        Exception.__init__(self, message)
+        self.status = status
+        self.retry_after = retry_after
+
+    def is_server_failure(self):
+        # network errors and 5xx responses mean the server is unhealthy, 4xx responses do not.
+        return self.status is None or self.status >= 500
+
+class CircuitOpenError(RequestError):
+    '''
+    Raised without sending the request, while a host is failing.
+    '''
+
+def parse_retry_after(value):
+    '''
+    Return the number of seconds to wait from a Retry-After header (delay in seconds or an HTTP
+    date), or None if it is missing or invalid.
+    '''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, mktime_tz(parsed) - time.time())
+
+class RetryPolicy(object):
+    '''
+    Decides if, and when, a failed request is sent again.
+
+    Network errors and 5xx responses are only retried for idempotent requests:
+    GET/HEAD/PUT/DELETE, and the POST endpoints registered in idempotent_endpoints
+    (like the find-or-create /book endpoint). 429 and 503 responses mean the
+    request was not processed, so they are retried for any request, honouring
+    the Retry-After header. Delays grow exponentially with "full jitter", so
+    parallel workers do not retry in lock step.
+    '''
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+    RETRY_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+    NOT_PROCESSED_STATUSES = frozenset([429, 503])
+
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=30.0, idempotent_endpoints=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # (method, endpoint) pairs of non-idempotent methods that are safe to repeat. Endpoints must match
+        # exactly, so a safe endpoint does not cover the endpoints below it (like /book/delete/batch).
+        self.idempotent_endpoints = set(idempotent_endpoints or [])
+
+    def is_idempotent(self, method, endpoint):
+        if method in self.IDEMPOTENT_METHODS:
+            return True
+        return (method, endpoint) in self.idempotent_endpoints
+
+    def should_retry(self, method, endpoint, attempt, error):
+        '''
+        :param attempt: the number of attempts made so far.
+        :param error: the RequestError of the last attempt.
+        '''
+        if attempt >= self.max_attempts or isinstance(error, CircuitOpenError):
+            return False
+        if error.retry_after is not None and error.retry_after > self.max_delay:
+            # the server asked for a longer pause than we are willing to block for.
+            return False
+        if error.status in self.NOT_PROCESSED_STATUSES:
+            return True
+        if error.status is None or error.status in self.RETRY_STATUSES:
+            return self.is_idempotent(method, endpoint)
+        return False
+
+    def backoff(self, attempt, retry_after=None):
+        '''
+        Return the number of seconds to wait before the next attempt.
+        '''
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, method, endpoint, send, circuit_breaker=None):
+        '''
+        Call send() until it succeeds or the failure should not be retried.
+        send must raise a RequestError on failure, any other error is raised without retrying.
+        '''
+        attempt = 0
+        while True:
+            attempt += 1
+            if circuit_breaker is not None:
+                circuit_breaker.before_request()
+            success = False
+            try:
+                result = send()
+                success = True
+                return result
+            except RequestError, e:
+                success = not e.is_server_failure()
+                if not self.should_retry(method, endpoint, attempt, e):
+                    raise
+                delay = self.backoff(attempt, e.retry_after)
+                logger.warning('%s %s failed (%s), retrying in %.1fs' % (method, endpoint, e, delay))
+            finally:
+                # other errors (socket.error, IOError, ValueError) count as failures, so a trial
+                # request always ends, and never leaves the circuit half open for good.
+                if circuit_breaker is not None:
+                    circuit_breaker.record_result(success)
+            time.sleep(delay)
+
+class CircuitBreaker(object):
+    '''
+    Fails fast while a host is down, instead of making every request wait for its own timeouts
+    and retries.
+
+    After failure_threshold consecutive failures the circuit opens, and requests raise
+    CircuitOpenError for reset_timeout seconds. Then a single trial request is let through
+    (half open): success closes the circuit again, failure re-opens it.
+    '''
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def before_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.time() - self._opened_at < self.reset_timeout or self._trial:
+                raise CircuitOpenError('QuietThyme is not responding, try again in a few moments.')
+            self._trial = True
+
+    def record_result(self, success):
+        with self._lock:
+            self._trial = False
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning('Too many failed requests, pausing requests for %ds' % self.reset_timeout)
+                self._opened_at = time.time()
@@ -0,0 +1,70 @@
+import os
+import json
+import time
+import errno
+import hashlib
+import threading
+import logging
+from calibre_plugins.quietthyme.client.fileutil import atomic_write
+
+# get the config_directory (where the cache is stored)
+from calibre.constants import config_dir
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
+__docformat__ = 'restructuredtext en'
+
+logger = logging.getLogger(__name__)
+
+class StatusCache(object):
+    '''
+    The QuietThyme storage settings from the last status request, persisted between sessions.
+
+    The settings are stored with a fingerprint of the token they were fetched with, so
+    logging in as another user (or with a new token) never reuses them, and are only
+    returned for ttl seconds after they were fetched.
+    '''
+    _lock = threading.RLock()
+
+    def __init__(self, ttl, cache_path=None):
+        self.ttl = ttl
+        self.cache_path = cache_path or os.path.join(config_dir, 'plugins/quietthyme/status.json')
+
+    @classmethod
+    def fingerprint(cls, token):
+        # the token itself is a credential, only a hash of it is written to disk.
+        return hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        '''
+        Return the cached settings for token, or None if there are none or they have expired.
+        '''
+        with self._lock:
+            entry = self._load()
+        if entry.get('fingerprint') != self.fingerprint(token):
+            return None
+        if not 0 <= time.time() - entry.get('fetched_at', 0) < self.ttl:
+            return None
+        return entry.get('settings')
+
+    def put(self, token, settings):
+        with self._lock:
+            self._save({'fingerprint': self.fingerprint(token), 'fetched_at': time.time(), 'settings': settings})
+
+    def clear(self):
+        with self._lock:
+            try:
+                os.remove(self.cache_path)
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    raise
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'rb') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self, entry):
+        atomic_write(self.cache_path, json.dumps(entry))
@@ -0,0 +1,181 @@
+import os
+import hashlib
+import threading
+import collections
+import logging
+from calibre_plugins.quietthyme.config import prefs
+from calibre_plugins.quietthyme.client.requestmanager import RequestManager
+from calibre_plugins.quietthyme.client.workerpool import WorkerPool
+from calibre_plugins.quietthyme.client.fileutil import ensure_dir
+
+# get the config_directory (where the thumbnails are cached)
+from calibre.constants import config_dir
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
+__docformat__ = 'restructuredtext en'
+
+logger = logging.getLogger(__name__)
+
+COVER_BASE_URL = 'https://s3.amazonaws.com/'
+
+class ThumbnailCache(object):
+    '''
+    A size capped, on-disk cache of book cover thumbnails.
+
+    Thumbnails are stored under the sha1 of their QuietThyme cover path, so a
+    reconnect can reuse covers that were already downloaded. When the cache
+    grows past max_size bytes the least recently used thumbnails are evicted.
+    '''
+    _default = None
+    _default_lock = threading.Lock()
+
+    @classmethod
+    def default(cls):
+        '''
+        The shared cache stored in the calibre config directory.
+        '''
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls(os.path.join(config_dir, 'plugins/quietthyme/thumbnails'),
+                                   prefs['thumbnail_cache_size'])
+            return cls._default
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # key -> size in bytes, ordered from least to most recently used.
+        self._entries = None
+        self._size = 0
+        # cover paths that could not be downloaded this session, so broken covers are not requested again.
+        self._failed = set()
+
+    def get(self, cover_path):
+        '''
+        Return the cached thumbnail data for cover_path, or None if it is not cached.
+        '''
+        key = self._key(cover_path)
+        with self._lock:
+            entries = self._load_entries()
+            if key not in entries:
+                return None
+            entries[key] = entries.pop(key)
+
+        filepath = os.path.join(self.cache_dir, key)
+        try:
+            with open(filepath, 'rb') as f:
+                data = f.read()
+            # the modified time records recency, so the LRU order survives a restart.
+            os.utime(filepath, None)
+            return data
+        except (IOError, OSError):
+            with self._lock:
+                self._size -= self._entries.pop(key, 0)
+            return None
+
+    def fetch(self, cover_path):
+        '''
+        Return the thumbnail data for cover_path, downloading and caching it if necessary. Returns
+        None for a cover that already failed to download.
+        '''
+        data = self.get(cover_path)
+        if data is None:
+            with self._lock:
+                if cover_path in self._failed:
+                    return None
+            try:
+                data = RequestManager.create_request('GET', COVER_BASE_URL + cover_path, json_response=False,
+                                                     allow_redirects=True, external_request=True)
+            except Exception:
+                with self._lock:
+                    self._failed.add(cover_path)
+                raise
+            if data:
+                self.put(cover_path, data)
+            else:
+                with self._lock:
+                    self._failed.add(cover_path)
+        return data
+
+    def prefetch(self, cover_paths, concurrency=None):
+        '''
+        Download every cover in cover_paths that is not cached yet, in parallel.
+        Failures are logged and remembered, covers are not required. Afterwards
+        the covers can be read with get(), without any network requests.
+        '''
+        key_paths = dict((self._key(cover_path), cover_path) for cover_path in cover_paths if cover_path)
+        with self._lock:
+            entries = self._load_entries()
+            missing = [cover_path for key, cover_path in key_paths.iteritems()
+                       if key not in entries and cover_path not in self._failed]
+        if not missing:
+            return
+
+        pool = WorkerPool(concurrency or prefs['download_concurrency'])
+        for index, data, exc_info in pool.imap_unordered(self.fetch, missing):
+            if exc_info is not None:
+                logger.debug('Could not download cover %s: %s' % (missing[index], exc_info[1]))
+
+    def put(self, cover_path, data):
+        key = self._key(cover_path)
+        filepath = os.path.join(self.cache_dir, key)
+        temp_filepath = '%s.%d.tmp' % (filepath, threading.current_thread().ident)
+        try:
+            with open(temp_filepath, 'wb') as f:
+                f.write(data)
+            try:
+                os.rename(temp_filepath, filepath)
+            except OSError:
+                # windows will not rename over an existing file, another thread already cached this cover.
+                os.remove(temp_filepath)
+        except (IOError, OSError), e:
+            logger.debug('Could not cache cover %s: %s' % (cover_path, e))
+            return
+
+        with self._lock:
+            entries = self._load_entries()
+            self._size += len(data) - entries.pop(key, 0)
+            entries[key] = len(data)
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_size and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, key))
+            except OSError:
+                pass
+
+    def _load_entries(self):
+        # must be called with self._lock held.
+        if self._entries is not None:
+            return self._entries
+
+        try:
+            ensure_dir(self.cache_dir)
+        except OSError:
+            logger.debug('An error occured during creation of the thumbnail cache directory.')
+
+        found = []
+        for key in os.listdir(self.cache_dir) if os.path.isdir(self.cache_dir) else []:
+            if key.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, key))
+            except OSError:
+                continue
+            found.append((stat.st_mtime, key, stat.st_size))
+        found.sort()
+
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        for mtime, key, size in found:
+            self._entries[key] = size
+            self._size += size
+        self._evict()
+        return self._entries
+
+    def _key(self, cover_path):
+        return hashlib.sha1(cover_path.encode('utf-8')).hexdigest()
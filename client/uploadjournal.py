@@ -0,0 +1,77 @@
+import os
+import json
+import threading
+import logging
+from calibre_plugins.quietthyme.client.fileutil import atomic_write
+
+# get the config_directory (where the journal is stored)
+from calibre.constants import config_dir
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
+__docformat__ = 'restructuredtext en'
+
+logger = logging.getLogger(__name__)
+
+class UploadJournal(object):
+    '''
+    A small JSON journal of the multipart uploads that are in progress.
+
+    Every completed part is recorded as soon as it is uploaded, so an upload
+    that was interrupted (dropped connection, calibre restart) can be resumed
+    from the first missing part instead of from byte zero. Entries are keyed by
+    the destination book and the content hash of the file, because calibre
+    uploads a new temporary copy of the book every time.
+    '''
+    _lock = threading.RLock()
+
+    def __init__(self, journal_path=None):
+        self.journal_path = journal_path or os.path.join(config_dir, 'plugins/quietthyme/uploads.json')
+
+    @classmethod
+    def key(cls, storage_id, book_id, source, content_hash=None):
+        '''
+        Return the journal key for uploading a FileSource to a book. The whole file is hashed, so
+        parts uploaded for a file are never reused for a different file of the same book.
+        :param content_hash: the sha1 of source, if it was already computed.
+        '''
+        return '%s:%s:%s' % (storage_id, book_id, content_hash or source.hash('sha1'))
+
+    def get(self, key):
+        '''
+        Return the journal entry for key, or None if there is no upload in progress.
+        '''
+        with self._lock:
+            return self._load().get(key)
+
+    def start(self, key, upload_id, part_size):
+        '''
+        Record a new multipart upload, replacing any earlier entry for key.
+        '''
+        with self._lock:
+            entries = self._load()
+            entries[key] = {'upload_id': upload_id, 'part_size': part_size, 'parts': {}}
+            self._save(entries)
+
+    def record_part(self, key, part_number, etag):
+        with self._lock:
+            entries = self._load()
+            if key in entries:
+                entries[key]['parts'][str(part_number)] = etag
+                self._save(entries)
+
+    def remove(self, key):
+        with self._lock:
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._save(entries)
+
+    def _load(self):
+        try:
+            with open(self.journal_path, 'rb') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        atomic_write(self.journal_path, json.dumps(entries))
@@ -0,0 +1,117 @@
+import sys
+import threading
+import Queue
+import logging
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
+__docformat__ = 'restructuredtext en'
+
+logger = logging.getLogger(__name__)
+
+class WorkerPool(object):
+    '''
+    A bounded pool of threads used to overlap network bound work (API calls, uploads, downloads).
+
+    Results are always handed back on the calling thread, so callers can safely
+    report progress to calibre while the workers are busy.
+    '''
+
+    def __init__(self, concurrency=4):
+        self.concurrency = max(1, int(concurrency))
+
+    def imap_unordered(self, func, items):
+        '''
+        Run func over items and yield (index, result, exc_info) tuples as soon as each item
+        completes. exc_info is None on success, otherwise result is None.
+
+        When the consumer stops iterating early, no new items are started, and the items that are
+        already running are waited for, so they never outlive the resources the consumer cleans up.
+        '''
+        items = list(items)
+        tasks = Queue.Queue()
+        results = Queue.Queue()
+        stopped = threading.Event()
+        for index, item in enumerate(items):
+            tasks.put((index, item))
+
+        def worker():
+            while not stopped.is_set():
+                try:
+                    index, item = tasks.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results.put((index, func(item), None))
+                except Exception:
+                    results.put((index, None, sys.exc_info()))
+
+        threads = []
+        for i in range(min(self.concurrency, len(items))):
+            thread = threading.Thread(target=worker, name='quietthyme-worker-%d' % i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for i in range(len(items)):
+                yield results.get()
+        finally:
+            stopped.set()
+            for thread in threads:
+                thread.join()
+
+    def map(self, func, items, callback=None):
+        '''
+        Run func over items and return the results in input order.
+
+        The first exception raised by func is re-raised once the items that were already
+        running have finished, and no new items are started after it.
+        :param callback: called on the calling thread as callback(completed, total) after each item.
+        '''
+        items = list(items)
+        ordered = [None] * len(items)
+        results = self.imap_unordered(func, items)
+        try:
+            for completed, (index, result, exc_info) in enumerate(results):
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                ordered[index] = result
+                if callback:
+                    callback(completed + 1, len(items))
+        finally:
+            results.close()
+        return ordered
+
+class BackgroundTask(object):
+    '''
+    Run a single callable on a background thread, and collect its result later with :meth:`result`.
+    '''
+
+    def __init__(self, func, *args, **kwargs):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        thread = threading.Thread(target=self._run, args=(func, args, kwargs), name='quietthyme-background')
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, func, args, kwargs):
+        try:
+            self._result = func(*args, **kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self):
+        '''
+        Block until the callable has finished, then return its value (or re-raise its exception).
+        '''
+        self._done.wait()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
@@ -38,6 +38,56 @@ prefs.defaults['beta_mode'] = False
 # (String) the access token used to communicate with the quietthyme API
 prefs.defaults['token'] = ''
 
+# (Int) the number of books that are uploaded to QuietThyme at the same time.
+prefs.defaults['upload_concurrency'] = 4
+
+# (Int) the maximum number of books sent to QuietThyme in a single batch request.
+prefs.defaults['batch_size'] = 50
+
+# (Int) the number of partitions a storage listing is split into and fetched in parallel. 1 disables segmented listing.
+prefs.defaults['listing_segments'] = 1
+
+# (Int) the number of files (covers, books) that are downloaded from QuietThyme at the same time.
+prefs.defaults['download_concurrency'] = 8
+
+# (Int) the number of books that are deleted at the same time, when QuietThyme does not support batch deletes.
+prefs.defaults['delete_concurrency'] = 8
+
+# (Int) books larger than this many bytes are uploaded in parts, which can be resumed if the upload is interrupted.
+prefs.defaults['multipart_threshold'] = 64 * 1024 * 1024
+
+# (Int) the size in bytes of each part of a multipart upload.
+prefs.defaults['multipart_part_size'] = 8 * 1024 * 1024
+
+# (Int) the number of parts of a single book that are uploaded at the same time.
+prefs.defaults['multipart_concurrency'] = 4
+
+# (Int) the maximum number of requests per second sent to the QuietThyme API, and to storage urls. 0 disables the limit.
+prefs.defaults['api_requests_per_second'] = 10
+prefs.defaults['storage_requests_per_second'] = 50
+
+# (Int) the maximum number of requests in flight to the QuietThyme API, and to storage urls. Below this the
+# limit adapts: it grows while responses stay fast, and is halved when QuietThyme throttles requests.
+prefs.defaults['api_max_concurrency'] = 8
+prefs.defaults['storage_max_concurrency'] = 32
+
+# (Int) the maximum number of bytes per second uploaded to, and downloaded from, QuietThyme storage, shared by
+# all concurrent transfers. 0 means unlimited.
+prefs.defaults['max_upload_rate'] = 0
+prefs.defaults['max_download_rate'] = 0
+
+# (Bool) gzip JSON request bodies of at least compress_requests_min_size bytes. Off by default, the
+# QuietThyme API must accept gzip Content-Encoding for it to work.
+prefs.defaults['compress_requests'] = False
+prefs.defaults['compress_requests_min_size'] = 16 * 1024
+
+# (Int) the maximum size in bytes of the on-disk cover thumbnail cache.
+prefs.defaults['thumbnail_cache_size'] = 100 * 1024 * 1024
+
+# (Int) the number of seconds the storage status from the last session is used to open the plugin straight
+# away. The status is still refreshed in the background.
+prefs.defaults['status_cache_ttl'] = 60 * 60
+
 master_api_base = 'https://api.quietthyme.com/v1'
 master_web_base = 'https://www.quietthyme.com'
 
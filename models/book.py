@@ -6,6 +6,8 @@ __docformat__ = 'restructuredtext en'
 import os, re, time, sys, logging
 from calibre.ebooks.metadata.book.base import Metadata
 from calibre.ebooks.metadata import title_sort
+from calibre_plugins.quietthyme.client.thumbnailcache import ThumbnailCache
+from calibre_plugins.quietthyme.models.storagepath import StoragePath
 
 logger = logging.getLogger(__name__)
 
@@ -37,9 +39,8 @@ class Book(Metadata):
         book.size = qt_metadata['storage_size']
         #book.datetime = qt_metadata[]
         book.quietthyme_id = qt_metadata['id']
-        book.path = qt_metadata['storage_type'] + '://' + \
-                    str(qt_metadata['id']) + '/' + \
-                    qt_metadata['storage_filename'] + qt_metadata['storage_format']
+        book.path = StoragePath(qt_metadata['storage_type'], qt_metadata['id'],
+                                qt_metadata['storage_filename'] + qt_metadata['storage_format']).path
         book.thumbnail = None
         book.tags = qt_metadata['tags']
 
@@ -71,11 +72,8 @@ class Book(Metadata):
         #book.thumbnail = Thumbnail('http://ak-hdl.buzzfed.com/static/enhanced/webdr06/2013/7/30/18/grid-cell-14969-1375222023-8.jpg')
         cover_path = qt_metadata.get('cover', '')
         if cover_path:
-            import urllib2
-            try:
-                book.thumbnail = urllib2.urlopen("https://s3.amazonaws.com/" + cover_path).read()
-            except:
-                book.thumbnail = None
+            # books() and upload_books() prefetch covers in bulk, a cover that is not cached by then is left out.
+            book.thumbnail = ThumbnailCache.default().get(cover_path)
 
         return book
         #raise NotImplementedError()
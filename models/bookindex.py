@@ -0,0 +1,232 @@
+__license__   = 'GPL v3'
+__copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
+__docformat__ = 'restructuredtext en'
+
+import os
+import json
+import sqlite3
+import threading
+import logging
+from calibre_plugins.quietthyme.client.fileutil import ensure_dir
+
+# get the config_directory (where the index database is stored)
+from calibre.constants import config_dir
+
+logger = logging.getLogger(__name__)
+
+class BookIndex(object):
+    '''
+    A persistent, local index of the QuietThyme book metadata for a single storage.
+
+    The index lets books() answer immediately on reconnect, while the listing is
+    reconciled with QuietThyme in the background. It also keeps the cursor
+    (HighWaterMark) of the last full listing, so later reconnects can ask
+    QuietThyme for only the books that changed.
+    '''
+    _lock = threading.RLock()
+    BATCH_SIZE = 500
+
+    def __init__(self, storage_id, db_path=None):
+        self.storage_id = unicode(storage_id)
+        self.db_path = db_path or os.path.join(config_dir, 'plugins/quietthyme/books.sqlite')
+
+    def items(self):
+        '''
+        Return the indexed book metadata, in the order it was listed by QuietThyme.
+        '''
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute('SELECT data FROM books WHERE storage_id = ? ORDER BY position',
+                                    (self.storage_id,))
+                return [json.loads(data) for (data,) in rows]
+            finally:
+                conn.close()
+
+    def get(self, book_id):
+        '''
+        Return the indexed metadata for a single book, or None if it is not indexed.
+        '''
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute('SELECT data FROM books WHERE storage_id = ? AND id = ?',
+                                   (self.storage_id, unicode(book_id))).fetchone()
+                return json.loads(row[0]) if row else None
+            finally:
+                conn.close()
+
+    def last_upload(self, book_id):
+        '''
+        Return a (content_hash, qt_book_data) tuple for the file that was last uploaded for a book,
+        or (None, None) if none was recorded.
+        '''
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute('SELECT content_hash, data FROM uploads WHERE storage_id = ? AND id = ?',
+                                   (self.storage_id, unicode(book_id))).fetchone()
+                return (row[0], json.loads(row[1])) if row else (None, None)
+            finally:
+                conn.close()
+
+    def record_upload(self, qt_book_data, content_hash):
+        '''
+        Remember the content hash and resulting book data of an upload. These are kept apart from the
+        listed metadata, so a listing that does not include hashes does not wipe them out. They are
+        dropped when the book is removed from the index. Uploads without a content_hash (files that
+        were not hashed) are not recorded.
+        '''
+        if content_hash is None:
+            return
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('INSERT OR REPLACE INTO uploads (storage_id, id, content_hash, data) VALUES (?, ?, ?, ?)',
+                                 (self.storage_id, unicode(qt_book_data['id']), content_hash, json.dumps(qt_book_data)))
+            finally:
+                conn.close()
+
+    def high_water_mark(self):
+        '''
+        Return the QuietThyme cursor of the last successful listing, or None if there is none.
+        '''
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute('SELECT high_water_mark FROM storages WHERE storage_id = ?',
+                                   (self.storage_id,)).fetchone()
+                return row[0] if row else None
+            finally:
+                conn.close()
+
+    def sync(self, qt_items, listing_info=None):
+        '''
+        Generator that yields every item of a full QuietThyme listing while storing it in the index.
+        Only books whose last_modified changed are rewritten, unchanged books only get their new
+        position, and once the listing is exhausted any book that was not listed is removed from
+        the index. When a delta is applied while the listing is read, the books it changed are
+        newer than the listing, they are left alone and the delta's cursor is kept.
+        :param listing_info: dict populated by the ApiClient listing with its HighWaterMark.
+        '''
+        with self._lock:
+            known = self._rows()
+            start_mark = self.high_water_mark()
+
+        seen = set()
+        changed = []
+        moved = []
+        for position, item in enumerate(qt_items):
+            book_id = unicode(item['id'])
+            seen.add(book_id)
+            if book_id not in known or known[book_id][0] != item.get('last_modified'):
+                changed.append((self.storage_id, book_id, item.get('last_modified'), position, json.dumps(item)))
+            elif known[book_id][1] != position:
+                # books listed before this one were added or removed, keep the listing order.
+                moved.append((position, self.storage_id, book_id))
+            if len(changed) + len(moved) >= self.BATCH_SIZE:
+                self._write_listed(known, start_mark, changed, [], moved=moved)
+                changed = []
+                moved = []
+            yield item
+
+        high_water_mark = (listing_info or {}).get('HighWaterMark')
+        self._write_listed(known, start_mark, changed, [book_id for book_id in known if book_id not in seen],
+                           high_water_mark, moved)
+
+    def apply_delta(self, qt_items, deleted_ids, high_water_mark):
+        '''
+        Store the changed books and drop the deleted ones returned by an incremental listing,
+        then move the cursor forward to high_water_mark. Updated books keep their position, new
+        books are added after the last one.
+        '''
+        with self._lock:
+            conn = self._connect()
+            try:
+                positions = dict(conn.execute('SELECT id, position FROM books WHERE storage_id = ?',
+                                              (self.storage_id,)))
+            finally:
+                conn.close()
+
+            position = max(positions.values()) if positions else -1
+            changed = []
+            for item in qt_items:
+                book_id = unicode(item['id'])
+                if book_id not in positions:
+                    position += 1
+                    positions[book_id] = position
+                changed.append((self.storage_id, book_id, item.get('last_modified'), positions[book_id], json.dumps(item)))
+            self._write(changed, [unicode(book_id) for book_id in deleted_ids], high_water_mark)
+
+    def clear(self):
+        self._write([], None)
+
+    def _rows(self):
+        # id -> (last_modified, position) of every indexed book.
+        with self._lock:
+            conn = self._connect()
+            try:
+                return dict((book_id, (last_modified, position)) for book_id, last_modified, position in
+                            conn.execute('SELECT id, last_modified, position FROM books WHERE storage_id = ?',
+                                         (self.storage_id,)))
+            finally:
+                conn.close()
+
+    def _write_listed(self, known, start_mark, changed, deleted_ids, high_water_mark=None, moved=()):
+        # write part of a full listing that started when the index held the known rows and start_mark.
+        # If the high-water mark moved since, a delta was applied in between: only books the delta did not
+        # add, change or delete are written, and the newer high-water mark is kept.
+        with self._lock:
+            if self.high_water_mark() != start_mark:
+                rows = self._rows()
+                untouched = lambda book_id: rows.get(book_id, (None,))[0] == known.get(book_id, (None,))[0] \
+                                            and (book_id in rows) == (book_id in known)
+                changed = [row for row in changed if untouched(row[1])]
+                moved = [row for row in moved if untouched(row[2])]
+                deleted_ids = [book_id for book_id in deleted_ids if untouched(book_id)]
+                high_water_mark = None
+            self._write(changed, deleted_ids, high_water_mark, moved)
+
+    def _write(self, changed, deleted_ids, high_water_mark=None, moved=()):
+        # deleted_ids of None removes every book in this storage. moved is a list of
+        # (position, storage_id, id) tuples of unchanged books that moved in the listing.
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    for table in ('books', 'uploads'):
+                        if deleted_ids is None:
+                            conn.execute('DELETE FROM %s WHERE storage_id = ?' % table, (self.storage_id,))
+                        else:
+                            conn.executemany('DELETE FROM %s WHERE storage_id = ? AND id = ?' % table,
+                                             [(self.storage_id, book_id) for book_id in deleted_ids])
+                    conn.executemany('INSERT OR REPLACE INTO books (storage_id, id, last_modified, position, data) '
+                                     'VALUES (?, ?, ?, ?, ?)', changed)
+                    conn.executemany('UPDATE books SET position = ? WHERE storage_id = ? AND id = ?', moved)
+                    if deleted_ids is None or high_water_mark is not None:
+                        conn.execute('INSERT OR REPLACE INTO storages (storage_id, high_water_mark) VALUES (?, ?)',
+                                     (self.storage_id, high_water_mark))
+            finally:
+                conn.close()
+
+    def _connect(self):
+        ensure_dir(os.path.dirname(self.db_path))
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('CREATE TABLE IF NOT EXISTS books ('
+                     'storage_id TEXT NOT NULL, '
+                     'id TEXT NOT NULL, '
+                     'last_modified TEXT, '
+                     'position INTEGER, '
+                     'data TEXT NOT NULL, '
+                     'PRIMARY KEY (storage_id, id))')
+        conn.execute('CREATE TABLE IF NOT EXISTS storages ('
+                     'storage_id TEXT PRIMARY KEY, '
+                     'high_water_mark TEXT)')
+        conn.execute('CREATE TABLE IF NOT EXISTS uploads ('
+                     'storage_id TEXT NOT NULL, '
+                     'id TEXT NOT NULL, '
+                     'content_hash TEXT NOT NULL, '
+                     'data TEXT NOT NULL, '
+                     'PRIMARY KEY (storage_id, id))')
+        return conn
@@ -4,12 +4,21 @@ __docformat__ = 'restructuredtext en'
 
 import logging
 from calibre.devices.interface import BookList as _BookList
+from calibre_plugins.quietthyme.models.storagepath import StoragePath
 logger = logging.getLogger(__name__)
 class BookList(_BookList):
+    '''
+    A calibre BookList that keeps hash indexes of its books by quietthyme_id (_bookmap) and by
+    path (_pathmap), so duplicate detection and lookups do not scan the whole list. Every list
+    mutator is overridden to keep the indexes consistent.
+    '''
 
     def __init__(self, oncard, prefix, settings):
         _BookList.__init__(self, oncard, prefix, settings)
         self._bookmap = {}
+        self._pathmap = {}
+        # id() of each entry to its position in the list, checked on use and rebuilt when it is stale.
+        self._positions = {}
 
     def supports_collections(self):
         return False
@@ -22,20 +31,161 @@ class BookList(_BookList):
         Add the book to the booklist, if needed. Return None if the book is
         already there and not updated, otherwise return the book.
         '''
-        try:
-            b = self.index(book) if check_for_duplicates else None
-        except (ValueError, IndexError):
-            b = None
+        b = self.find_book(book) if check_for_duplicates else None
         if b is None:
             self.append(book)
             return book
         if replace_metadata:
-            self[b].smart_update(book, replace_metadata=True)
-            return self[b]
+            self._unindex(b)
+            b.smart_update(book, replace_metadata=True)
+            self._index(b)
+            return b
         return None
 
+    def find_book(self, book):
+        '''
+        Return the book in the list that is equal to book (same quietthyme_id), or None.
+        '''
+        if book.quietthyme_id == -1:
+            return None
+        return self._bookmap.get(book.quietthyme_id, None)
+
+    def find_book_by_path(self, path):
+        return self._pathmap.get(path, None)
+
     def remove_book(self, book):
         self.remove(book)
 
+    def remove_books_by_path(self, paths):
+        '''
+        Remove every book whose path is in paths, using the path index instead of one scan per
+        path. Paths are normalized with StoragePath first, so calibre device paths that carry a
+        prefix match the path of the book.
+        :return: the removed books.
+        '''
+        removed = {}
+        for path in paths:
+            storage_path = StoragePath.try_parse(path)
+            book = self._pathmap.get(storage_path.path if storage_path is not None else path, None)
+            if book is not None:
+                removed[self._position(book)] = book
+
+        # delete from the end, so the positions of the books still to be deleted do not change.
+        for i in sorted(removed, reverse=True):
+            _BookList.__delitem__(self, i)
+            self._unindex(removed[i])
+        return removed.values()
+
+    def apply_delta(self, books, deleted_ids):
+        '''
+        Apply an incremental listing to the booklist. Books with the same quietthyme_id as one of
+        the changed books are replaced where they are, books in deleted_ids are removed and the
+        remaining changed books are added at the end.
+        '''
+        changed = dict((book.quietthyme_id, book) for book in books)
+        stale_ids = set(deleted_ids) - set(changed)
+        entries = []
+        for book in self:
+            if book.quietthyme_id in stale_ids:
+                continue
+            entries.append(changed.pop(book.quietthyme_id, book))
+        entries.extend(book for book in books if changed.pop(book.quietthyme_id, None) is book)
+        self[:] = entries
+
     def get_collections(self):
-        return {}
\ No newline at end of file
+        return {}
+
+    ####################################################################################################################
+    # list mutators, overridden to keep _bookmap and _pathmap up to date.
+
+    def append(self, book):
+        _BookList.append(self, book)
+        self._positions[id(book)] = len(self) - 1
+        self._index(book)
+
+    def extend(self, books):
+        for book in books:
+            self.append(book)
+
+    def __iadd__(self, books):
+        self.extend(books)
+        return self
+
+    def insert(self, i, book):
+        _BookList.insert(self, i, book)
+        self._index(book)
+
+    def remove(self, book):
+        # find the book through _bookmap and by identity, list.index would compare every book with __eq__,
+        # which never matches placeholder books.
+        i = None
+        if book.quietthyme_id != -1:
+            i = self._position(self._bookmap.get(book.quietthyme_id, None))
+        if i is None:
+            i = self._position(book)
+        if i is None:
+            raise ValueError('book is not in the list')
+        self.pop(i)
+
+    def pop(self, i=-1):
+        book = _BookList.pop(self, i)
+        self._positions.pop(id(book), None)
+        self._unindex(book)
+        return book
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            _BookList.__setitem__(self, i, value)
+            self._reindex()
+            return
+        old_book = _BookList.__getitem__(self, i)
+        _BookList.__setitem__(self, i, value)
+        self._unindex(old_book)
+        self._index(value)
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            _BookList.__delitem__(self, i)
+            self._reindex()
+            return
+        self.pop(i)
+
+    # python 2 routes simple slices (self[i:j]) through these instead of __setitem__/__delitem__
+    def __setslice__(self, i, j, books):
+        _BookList.__setslice__(self, i, j, books)
+        self._reindex()
+
+    def __delslice__(self, i, j):
+        _BookList.__delslice__(self, i, j)
+        self._reindex()
+
+    def _index(self, book):
+        if book.quietthyme_id != -1:
+            self._bookmap[book.quietthyme_id] = book
+        if book.path:
+            self._pathmap[book.path] = book
+
+    def _unindex(self, book):
+        # only drop the entries that still point at this exact book.
+        if self._bookmap.get(book.quietthyme_id, None) is book:
+            del self._bookmap[book.quietthyme_id]
+        if self._pathmap.get(book.path, None) is book:
+            del self._pathmap[book.path]
+
+    def _position(self, entry):
+        # the position of entry (by identity) in the list, or None. Insertions and removals only
+        # leave the cached positions stale, which is detected here.
+        if entry is None:
+            return None
+        i = self._positions.get(id(entry), None)
+        if i is not None and i < len(self) and _BookList.__getitem__(self, i) is entry:
+            return i
+        self._positions = dict((id(other), j) for j, other in enumerate(self))
+        return self._positions.get(id(entry), None)
+
+    def _reindex(self):
+        self._bookmap = {}
+        self._pathmap = {}
+        self._positions = {}
+        for book in self:
+            self._index(book)
\ No newline at end of file
@@ -0,0 +1,80 @@
+__license__   = 'GPL v3'
+__copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
+__docformat__ = 'restructuredtext en'
+
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+class StoragePath(object):
+    '''
+    The path of a book in QuietThyme storage: storage_type://book_id/file_name. It is the
+    path of the Book in calibre, and identifies the book in delete and download requests.
+
+    Parsed paths are memoized, so bulk operations over the same paths (delete, download,
+    remove from the booklists) only parse each path once. Paths may carry a prefix, like
+    calibre device paths, the file name may contain sub directories.
+    '''
+    __slots__ = ('storage_type', 'book_id', 'file_name', '_path')
+
+    PATTERN = re.compile(r"(?P<storage_type>[^:/]+)://(?P<book_id>[^/]+)/(?P<file_name>.+)$")
+    CACHE_SIZE = 10000
+    _cache = {}
+
+    def __init__(self, storage_type, book_id, file_name):
+        self.storage_type = storage_type
+        self.book_id = unicode(book_id)
+        self.file_name = file_name
+        self._path = None
+
+    @classmethod
+    def parse(cls, path):
+        '''
+        Return the StoragePath for path.
+        :raises ValueError: if path is not a QuietThyme storage path.
+        '''
+        storage_path = cls._cache.get(path)
+        if storage_path is None:
+            match = cls.PATTERN.search(path)
+            if match is None:
+                raise ValueError('Invalid QuietThyme storage path: %s' % path)
+            storage_path = cls(*match.group('storage_type', 'book_id', 'file_name'))
+            if len(cls._cache) >= cls.CACHE_SIZE:
+                cls._cache.clear()
+            cls._cache[path] = storage_path
+        return storage_path
+
+    @classmethod
+    def try_parse(cls, path):
+        '''
+        Return the StoragePath for path, or None if path is not a QuietThyme storage path.
+        '''
+        try:
+            return cls.parse(path)
+        except ValueError:
+            return None
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = u'%s://%s/%s' % (self.storage_type, self.book_id, self.file_name)
+        return self._path
+
+    def __unicode__(self):
+        return self.path
+
+    def __str__(self):
+        return self.path.encode('utf-8')
+
+    def __repr__(self):
+        return 'StoragePath(%r)' % self.path
+
+    def __eq__(self, other):
+        return isinstance(other, StoragePath) and self.path == other.path
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.path)
@@ -6,7 +6,7 @@ __license__   = 'GPL v3'
 __copyright__ = '2011, Jason Kulatunga <jason@quietthyme.com>'
 __docformat__ = 'restructuredtext en'
 
-import traceback, os, urllib2, sys, logging, errno, copy
+import traceback, os, sys, logging, errno, copy, threading
 from calibre_plugins.quietthyme import version
 
 # The class that sets and stores the user configured preferences
@@ -14,11 +14,19 @@ from calibre_plugins.quietthyme.config import prefs
 # The file that contains the Book and Booklist classes
 from calibre_plugins.quietthyme.models.book import Book
 from calibre_plugins.quietthyme.models.booklist import BookList
+from calibre_plugins.quietthyme.models.bookindex import BookIndex
 #Quietthyme api client.
 from calibre_plugins.quietthyme.client.api import ApiClient
+from calibre_plugins.quietthyme.client.requestmanager import RequestManager
+from calibre_plugins.quietthyme.client.retry import RequestError
+from calibre_plugins.quietthyme.client.workerpool import WorkerPool, BackgroundTask
+from calibre_plugins.quietthyme.client.thumbnailcache import ThumbnailCache
+from calibre_plugins.quietthyme.client.filesource import FileSource, file_source
+from calibre_plugins.quietthyme.client.connectivity import ConnectivityMonitor
+from calibre_plugins.quietthyme.client.statuscache import StatusCache
 
 # The device error classes.
-from calibre.devices.errors import OpenFeedback,OpenFailed
+from calibre.devices.errors import OpenFeedback,OpenFailed,UserFeedback
 
 # get the config_directory (where the icon gets extracted to)
 from calibre.constants import config_dir
@@ -65,6 +73,16 @@ class QuietthymeDevicePlugin(DevicePlugin):
 
         #quietthyme server cache
         self.qt_settings = {}
+        #background BookIndex syncs, by storage_id
+        self.index_syncs = {}
+        #the last BookList returned by books(), by card_id
+        self.booklists = {}
+        #probes the QuietThyme API host in the background, for detect_managed_devices
+        self.connectivity = ConnectivityMonitor()
+        #the background status refresh, and whether another refresh was requested while it was running
+        self.status_refresh = None
+        self.status_refresh_pending = False
+        self.status_lock = threading.Lock()
 
     """
         Defines the interface that should be implemented by backends that
@@ -268,15 +286,12 @@ class QuietthymeDevicePlugin(DevicePlugin):
         '''
         #logger.debug(sys._getframe().f_code.co_name)
         if (not self.is_connected) and (not self.is_ejected):
-            # check if the user is connected to the internet.
-            try:
-                urllib2.urlopen('http://www.google.com', timeout=1)
+            # check if the user can reach QuietThyme. The probe runs in the background, so this poll never blocks.
+            if self.connectivity.is_online(force_refresh):
                 # The user has not ejected Quietthyme,  doesnt have an active connection and has a valid internet connection.
                 # Attempt to open a new connection to the "device"
                 return True
-            except urllib2.URLError:
-                logger.warn('Not connected to the internet, cannot open Quietthyme plugin')
-                return None
+            return None
         elif self.is_connected:
             #the device is already connected, skip so that open is not called repeatedly.
             return True
@@ -383,7 +398,36 @@ class QuietthymeDevicePlugin(DevicePlugin):
         # else:
         #     prefs['token'] = response['data']['token']
         # self.is_connected = response['success']
-        status_response = ApiClient().status(library_uuid, current_library_name())
+        self.current_library_uuid = library_uuid
+        qt_settings = StatusCache(prefs['status_cache_ttl']).get(prefs['token'])
+        if qt_settings is not None:
+            # open straight away with the settings from the last session, and bring them up to date in the background.
+            self.qt_settings = qt_settings
+            self.is_connected = True
+            self._refresh_status()
+            return
+
+        #mimic from
+        #https://github.com/kovidgoyal/calibre/blob/master/src/calibre/devices/usbms/driver.py
+        #https://github.com/kovidgoyal/calibre/blob/master/src/calibre/devices/usbms/device.py
+        self.qt_settings = self._fetch_status(library_uuid)
+        self.is_connected = True
+        #return True
+
+    def _fetch_status(self, library_uuid):
+        '''
+        Request the QuietThyme status, and store its settings in the StatusCache. The cached
+        settings are dropped when the token turns out to be invalid.
+        :return: the storage settings.
+        :raises OpenFeedback: if the status could not be retrieved.
+        '''
+        try:
+            status_response = ApiClient().status(library_uuid, current_library_name())
+        except RequestError as e:
+            # an invalid token (401) has already been removed by the RequestManager.
+            if e.status == 401:
+                StatusCache(prefs['status_cache_ttl']).clear()
+            raise OpenFeedback('Could not connect to QuietThyme: %s' % e)
         if not status_response['success']:
             # if an error occurs because token is invalid (401) then remove it.
             errorMessage = status_response.get('data', {}).get('errorMessage', {})
@@ -392,16 +436,42 @@ class QuietthymeDevicePlugin(DevicePlugin):
                 # if current_token == prefs.get('token'):
                     # the token hasnt changed, and its invalid, delete it.
                 prefs.pop('token', None)
+                StatusCache(prefs['status_cache_ttl']).clear()
 
             raise OpenFeedback(status_response['error_msg'])
-        self.is_connected = status_response['success']
-            #store the settings in memory
-        self.current_library_uuid = library_uuid
-        #mimic from
-        #https://github.com/kovidgoyal/calibre/blob/master/src/calibre/devices/usbms/driver.py
-        #https://github.com/kovidgoyal/calibre/blob/master/src/calibre/devices/usbms/device.py
-        self.qt_settings = status_response['data']['settings']
-        #return True
+        StatusCache(prefs['status_cache_ttl']).put(prefs['token'], status_response['data']['settings'])
+        return status_response['data']['settings']
+
+    def _refresh_status(self):
+        '''
+        Refresh qt_settings (and with it total_space and free_space) on a background thread. A
+        refresh requested while one is running is done again once it finishes.
+        '''
+        with self.status_lock:
+            self.status_refresh_pending = True
+            if self.status_refresh is None:
+                self.status_refresh = BackgroundTask(self._run_status_refresh)
+
+    def _run_status_refresh(self):
+        finished = False
+        try:
+            while True:
+                with self.status_lock:
+                    if not self.status_refresh_pending:
+                        self.status_refresh = None
+                        finished = True
+                        return
+                    self.status_refresh_pending = False
+                try:
+                    self.qt_settings = self._fetch_status(self.current_library_uuid)
+                except (OpenFeedback, StandardError) as e:
+                    # keep the settings we have, the next refresh may succeed.
+                    logger.warning('Could not refresh QuietThyme status: %s' % e)
+        finally:
+            # whatever happened, a later _refresh_status must be able to start a new refresh.
+            if not finished:
+                with self.status_lock:
+                    self.status_refresh = None
 
     def eject(self):
         '''
@@ -575,8 +645,24 @@ class QuietthymeDevicePlugin(DevicePlugin):
         storage_type = self.qt_settings.get(card_id,{}).get('storage_type',"")
         storage_id = self.qt_settings.get(card_id,{}).get('storage_id',None)
         if storage_id is not None:
-            qt_response = ApiClient().books_all(storage_id)['data']
-            qt_booklist = qt_response['Items']
+            index = BookIndex(storage_id)
+            qt_delta = self._fetch_book_delta(index)
+            if qt_delta is not None and self.booklists.get(card_id, (None, None))[0] == storage_id:
+                # only the books changed since the last listing were downloaded, apply them to the BookList we already have.
+                # every changed book is stale, even the ones that are left out because they are no longer stored.
+                booklist = self.booklists[card_id][1]
+                stale_ids = list(qt_delta['Deleted']) + [qt_metadata['id'] for qt_metadata in qt_delta['Items']]
+                booklist.apply_delta(list(self._books_from_quietthyme_metadata(qt_delta['Items'])), stale_ids)
+                self.report_progress(1.0, _('Loaded book from device'))
+                return booklist
+
+            qt_booklist = index.items()
+            if not qt_booklist:
+                listing_info = {}
+                qt_booklist = index.sync(self._list_books(storage_id, listing_info), listing_info)
+            elif qt_delta is None:
+                # answer from the local index straight away, and bring it up to date in the background.
+                self._sync_book_index(index)
         else:
             qt_booklist = []
 
@@ -597,11 +683,9 @@ class QuietthymeDevicePlugin(DevicePlugin):
         booklist.add_book(placeholderBook, False)
 
 
-        for i, qt_metadata in enumerate(qt_booklist):
-            self.report_progress((i+1) / float(len(qt_booklist)), _('Loading books from device...'))
-            if qt_metadata['storage_identifier']:
-                #logger.debug(qt_metadata)
-                booklist.add_book(Book.from_quietthyme_metadata(qt_metadata), False)
+        for book in self._books_from_quietthyme_metadata(qt_booklist):
+            booklist.add_book(book, False)
+        self.booklists[card_id] = (storage_id, booklist)
         self.report_progress(1.0, _('Loaded book from device'))
         return booklist
 
@@ -631,13 +715,32 @@ class QuietthymeDevicePlugin(DevicePlugin):
         logger.debug(files, names, on_card, metadata[0].__unicode__())
 
         card_id = self._convert_oncard_to_cardid(on_card)
-        dest_info = []
-        names = iter(names)
-        metadata = iter(metadata)
-        for i, local_filepath in enumerate(files):
-            local_metadata, fname = metadata.next(), names.next()
+        storage_id = self.qt_settings[card_id].get('storage_id', 'quietthyme')
+
+        jobs = zip(files, metadata)
+        # the prepared uploads, and the FileSources they were hashed from, of the batched books.
+        prepared = {}
+        sources = {}
+        # the error of each book that could not be uploaded, by its index in jobs.
+        failures = {}
 
-            qt_book_data = self._upload_book(local_filepath, self.qt_settings[card_id].get('storage_id', 'quietthyme'), local_metadata,  replace_file=True)
+        def upload(i):
+            local_filepath, local_metadata = jobs[i]
+            try:
+                if i not in prepared:
+                    qt_book_data = self._upload_book(local_filepath, storage_id, local_metadata,  replace_file=True)
+                else:
+                    qt_book_data, upload_url, content_hash, error_msg = prepared[i]
+                    if error_msg is not None:
+                        raise RequestError(error_msg)
+                    # books whose content is already stored in QuietThyme have no upload_url.
+                    if upload_url is not None:
+                        ApiClient().upload_bookstorage(upload_url, sources[i])
+                        BookIndex(storage_id).record_upload(qt_book_data, content_hash)
+            except RequestError as e:
+                # requests were already retried, give up on this book but keep uploading the others.
+                failures[i] = '%s: %s' % (local_metadata.title, e)
+                return (card_id, None)
             try:
 
                 if local_metadata.get('cover'):
@@ -648,10 +751,40 @@ class QuietthymeDevicePlugin(DevicePlugin):
                 # import traceback
                 # traceback.print_exc()
                 logger.error('could not upload cover %s' % inst)
+            return (card_id, qt_book_data) #pass the calibre metadata (mdata) as a backup, should not be used though...
 
-            dest_info.append((card_id, qt_book_data)) #pass the calibre metadata (mdata) as a backup, should not be used though...
-            self.report_progress((i+1) / float(len(files)), _('Transferring books to device...'))
-
+        # books are uploaded concurrently, but dest_info is still returned in the same order as files.
+        # Multi-book jobs create the books and prepare their storage with batch requests, one batch at
+        # a time so only that many files are open. Large books are left out, they are uploaded in parts
+        # by _upload_book.
+        dest_info = []
+        for group in self._chunks(range(len(jobs)), prefs['batch_size']):
+            batched = [i for i in group if not self._use_multipart_upload(jobs[i][0])]
+            try:
+                if len(batched) > 1:
+                    for i in batched:
+                        sources[i] = FileSource(jobs[i][0])
+                    prepared.update(zip(batched, self._prepare_uploads_batched(
+                        [(sources[i], jobs[i][1]) for i in batched], storage_id) or []))
+                dest_info.extend(WorkerPool(prefs['upload_concurrency']).map(upload, group,
+                    lambda completed, total: self.report_progress((len(dest_info) + completed) / float(len(jobs)),
+                                                                  _('Transferring books to device...'))))
+            finally:
+                for i in batched:
+                    if i in sources:
+                        sources.pop(i).close()
+
+        # uploads use up storage space, keep free_space current.
+        self._refresh_status()
+
+        if failures:
+            # the job must fail, or calibre goes on as if every book was uploaded (and, with "send to device and
+            # delete from library", deletes them from the library). The other books were still uploaded.
+            raise UserFeedback(_('%d books could not be uploaded to QuietThyme') % len(failures),
+                               '\n'.join(failures[i] for i in sorted(failures)), UserFeedback.ERROR)
+
+        # add_books_to_metadata must not use the network, so the covers of the new books are downloaded now.
+        ThumbnailCache.default().prefetch([location[1].get('cover') for location in dest_info])
         self.report_progress(1.0, _('Transferring books to device...'))
         logger.debug('finished uploading %d books'%(len(files)))
         logger.debug(dest_info)
@@ -700,15 +833,31 @@ class QuietthymeDevicePlugin(DevicePlugin):
         '''
         Delete books at paths on device.
         '''
-        from urlparse import urlparse
         logger.debug(sys._getframe().f_code.co_name)
         logger.debug(paths)
-        for i, qt_storage_id in enumerate(paths):
-            self.report_progress((i+1) / float(len(paths)), _('Deleting books from QuietThyme...'))
-            logger.debug(qt_storage_id)
-            if qt_storage_id == 'placeholder.ignore':
-                continue
-            ApiClient().destroy_book(qt_storage_id)
+        self.user_feedback_after_callback = None
+
+        paths = [path for path in paths if path != 'placeholder.ignore']
+        if not paths:
+            return
+        # books are deleted in batches (or concurrently), a failed book does not stop the others.
+        errors = ApiClient().destroy_books(paths,
+            lambda completed, total: self.report_progress(completed / float(total), _('Deleting books from QuietThyme...')))
+
+        failures = []
+        for path, error_msg in zip(paths, errors):
+            if error_msg is not None:
+                logger.error('could not delete %s: %s' % (path, error_msg))
+                failures.append('%s: %s' % (path, error_msg))
+        if failures:
+            self.user_feedback_after_callback = {
+                'title': _('Delete failed'),
+                'msg': _('%d books could not be deleted from QuietThyme') % len(failures),
+                'det_msg': '\n'.join(failures)
+            }
+
+        self._forget_indexed_books([path for path, error_msg in zip(paths, errors) if error_msg is None])
+        self._refresh_status()
         self.report_progress(1.0, _('Removing books from QuietThyme...'))
 
     def remove_books_from_metadata(self, paths, booklists):
@@ -724,12 +873,11 @@ class QuietthymeDevicePlugin(DevicePlugin):
 
         '''
         logger.debug(sys._getframe().f_code.co_name)
-        for i, path in enumerate(paths):
-            self.report_progress((i+1) / float(len(paths)), _('Removing books from Calibre metadata cache...'))
-            for bl in booklists:
-                for book in bl:
-                    if path.endswith(book.path):
-                        bl.remove_book(book)
+        # remove_books_by_path strips any prefix from the paths before it looks them up.
+        for i, bl in enumerate(booklists):
+            self.report_progress((i+1) / float(len(booklists)), _('Removing books from Calibre metadata cache...'))
+            if bl is not None:
+                bl.remove_books_by_path(paths)
 
         self.report_progress(1.0, _('Removing books from Calibre metadata cache...'))
 
@@ -770,7 +918,13 @@ class QuietthymeDevicePlugin(DevicePlugin):
 
         '''
         logger.debug(sys._getframe().f_code.co_name)
-        outfile.write(ApiClient().download_bookstorage(path))
+
+        def progress(written, total):
+            if total:
+                self.report_progress(written / float(total), _('Downloading book from QuietThyme...'))
+
+        # stream the book to outfile in chunks, instead of reading it into memory first.
+        ApiClient().download_bookstorage_to(path, outfile, progress)
 
     def save_settings(self, config_widget):
         '''
@@ -864,7 +1018,7 @@ class QuietthymeDevicePlugin(DevicePlugin):
         device thread, not the GUI thread.
         '''
         logger.debug(sys._getframe().f_code.co_name)
-        pass
+        RequestManager.pool.clear()
 
     def get_device_uid(self):
         '''
@@ -1075,30 +1229,123 @@ class QuietthymeDevicePlugin(DevicePlugin):
 
         qt_book_data = ApiClient().create_book(local_metadata)
 
-        #after creating book metadata, we need to get a signed url so we can upload the book to QuietThyme storage
-        qt_filename = self._create_upload_path('',local_metadata, local_filepath)
-        qt_filename_base, qt_filename_ext = os.path.splitext(qt_filename)
+        # the book is mapped once, and the same mapping is hashed and uploaded.
+        with FileSource(local_filepath) as source:
+            #after creating book metadata, we need to get a signed url so we can upload the book to QuietThyme storage
+            qt_storage_metadata = self._create_storage_metadata(qt_book_data, storage_id, source, local_metadata, replace_file)
 
-        qt_storage_metadata = {
-            'book_id': qt_book_data['id'],
-            'storage_id': storage_id,
-            'replace': replace_file,
+            if self._find_unchanged_storage(qt_book_data, qt_storage_metadata, source):
+                return qt_book_data
 
-            #only these parameters will be stored directly
-            'storage_size': os.stat(local_filepath).st_size, #storage size in bytes
-            'storage_filename': qt_filename_base, # nice filename for UI.=
-            'storage_format': qt_filename_ext # file extension
-        }
+            if self._use_multipart_upload(local_filepath):
+                # large books are uploaded in resumable parts, when QuietThyme supports it.
+                qt_multipart_book_data = ApiClient().upload_bookstorage_multipart(qt_storage_metadata, source)
+                if qt_multipart_book_data is not None:
+                    qt_book_data.update(qt_multipart_book_data)
+                    BookIndex(storage_id).record_upload(qt_book_data, qt_storage_metadata.get('storage_hash'))
+                    return qt_book_data
 
-        qt_upload_data = ApiClient().prepare_bookstorage(qt_storage_metadata)
-        qt_book_data.update(qt_upload_data['data']['book_data'])
+            qt_upload_data = ApiClient().prepare_bookstorage(qt_storage_metadata)
+            qt_book_data.update(qt_upload_data['data']['book_data'])
 
-        #TODO: this bookstorage uploader is a bit flimsy
-        ApiClient().upload_bookstorage(qt_upload_data['data']['upload_url'], local_filepath)
+            #TODO: this bookstorage uploader is a bit flimsy
+            ApiClient().upload_bookstorage(qt_upload_data['data']['upload_url'], source)
+            BookIndex(storage_id).record_upload(qt_book_data, qt_storage_metadata.get('storage_hash'))
 
 
         return qt_book_data
 
+    def _use_multipart_upload(self, local_filepath):
+        return os.path.getsize(local_filepath) > prefs['multipart_threshold']
+
+    def _create_storage_metadata(self, qt_book_data, storage_id, local_file, local_metadata, replace_file=True):
+        '''
+        :param local_file: the filepath, or an open FileSource, of the book. The storage_hash is only
+                           added by _find_unchanged_storage, for books that may already be stored.
+        '''
+        with file_source(local_file) as source:
+            qt_filename = self._create_upload_path('',local_metadata, source.filepath)
+            qt_filename_base, qt_filename_ext = os.path.splitext(qt_filename)
+
+            return {
+                'book_id': qt_book_data['id'],
+                'storage_id': storage_id,
+                'replace': replace_file,
+
+                #only these parameters will be stored directly
+                'storage_size': len(source), #storage size in bytes
+                'storage_filename': qt_filename_base, # nice filename for UI.=
+                'storage_format': qt_filename_ext # file extension
+            }
+
+    def _prepare_uploads_batched(self, jobs, storage_id):
+        '''
+        Create the books for a list of (local_file, local_metadata) jobs and get their signed
+        upload urls, using batch requests. local_file is a filepath or an open FileSource, which
+        the upload can then share.
+
+        :return: a (qt_book_data, upload_url, content_hash, error_msg) tuple per job, or None if
+                 QuietThyme does not support batch requests. upload_url is None for books that
+                 are already stored unchanged.
+        '''
+        created = ApiClient().create_books([local_metadata for local_file, local_metadata in jobs])
+        if created is None:
+            return None
+
+        prepared = [(qt_book_data, None, None, error_msg) for qt_book_data, error_msg in created]
+        pending = []
+        qt_storage_metadata_list = []
+        for i, (qt_book_data, error_msg) in enumerate(created):
+            if error_msg is not None:
+                continue
+            qt_storage_metadata = self._create_storage_metadata(qt_book_data, storage_id, jobs[i][0], jobs[i][1])
+            if not self._find_unchanged_storage(qt_book_data, qt_storage_metadata, jobs[i][0]):
+                pending.append(i)
+                qt_storage_metadata_list.append(qt_storage_metadata)
+
+        storage_results = ApiClient().prepare_bookstorage_many(qt_storage_metadata_list) if pending else []
+        if storage_results is None:
+            # creating books is find-or-create, so the per-book path can safely redo it.
+            return None
+
+        for i, qt_storage_metadata, (qt_upload_data, error_msg) in zip(pending, qt_storage_metadata_list, storage_results):
+            qt_book_data = created[i][0]
+            if error_msg is not None:
+                prepared[i] = (qt_book_data, None, None, error_msg)
+                continue
+            qt_book_data.update(qt_upload_data['book_data'])
+            prepared[i] = (qt_book_data, qt_upload_data['upload_url'], qt_storage_metadata.get('storage_hash'), None)
+        return prepared
+
+    def _find_unchanged_storage(self, qt_book_data, qt_storage_metadata, local_file):
+        '''
+        Check if QuietThyme storage already holds the exact file in local_file. The storage_hash
+        listed by QuietThyme is authoritative, the hash recorded by an earlier upload is only used
+        when the listing has none and the book was not modified since that upload. The file is only
+        hashed (into qt_storage_metadata['storage_hash']) for books in the BookIndex. If the file is
+        stored, the stored storage_* fields are copied into qt_book_data and True is returned.
+        '''
+        index = BookIndex(qt_storage_metadata['storage_id'])
+        # a book that is no longer listed may have been deleted, so never trust a recorded upload alone.
+        qt_indexed_data = index.get(qt_book_data['id'])
+        if qt_indexed_data is None or qt_indexed_data.get('storage_format') != qt_storage_metadata['storage_format']:
+            return False
+
+        content_hash = qt_storage_metadata['storage_hash'] = self._content_hash(local_file)
+        if qt_indexed_data.get('storage_hash'):
+            if qt_indexed_data['storage_hash'] != content_hash:
+                return False
+            qt_stored_data = qt_indexed_data
+        else:
+            uploaded_hash, qt_uploaded_data = index.last_upload(qt_book_data['id'])
+            if uploaded_hash != content_hash or qt_uploaded_data.get('last_modified') != qt_indexed_data.get('last_modified'):
+                return False
+            qt_stored_data = qt_uploaded_data
+
+        logger.info('book %s is unchanged in QuietThyme storage, skipping upload' % qt_book_data['id'])
+        qt_book_data.update((key, value) for key, value in qt_stored_data.items() if key.startswith('storage_'))
+        return True
+
     def _upload_cover(self, qt_book_data,
                       local_metadata):
         # using the return value of the uploaded book (the book ID) we should upload the cover to QuietThyme storage
@@ -1114,9 +1361,84 @@ class QuietthymeDevicePlugin(DevicePlugin):
         return qt_book_data
 
 
+    ####################################################################################################################
+    # Book Listing Helper Functions
+
+    def _list_books(self, storage_id, listing_info=None):
+        if prefs['listing_segments'] > 1:
+            return ApiClient().books_segmented(storage_id, prefs['listing_segments'], listing_info)
+        return ApiClient().books_iter(storage_id, listing_info)
+
+    def _sync_book_index(self, index):
+        sync_task = self.index_syncs.get(index.storage_id)
+        if sync_task is not None and not sync_task.done():
+            return
+
+        def sync():
+            try:
+                listing_info = {}
+                for qt_metadata in index.sync(self._list_books(index.storage_id, listing_info), listing_info):
+                    pass
+                logger.debug('finished syncing book index for storage %s' % index.storage_id)
+            except Exception as e:
+                logger.error('could not sync book index for storage %s: %s' % (index.storage_id, e))
+
+        self.index_syncs[index.storage_id] = BackgroundTask(sync)
+
+    def _fetch_book_delta(self, index):
+        # ask QuietThyme for the books changed since the last full listing, and store them in the index.
+        high_water_mark = index.high_water_mark()
+        if high_water_mark is None:
+            return None
+        try:
+            qt_delta = ApiClient().books_changed(index.storage_id, high_water_mark)
+        except Exception as e:
+            logger.error('could not fetch changed books for storage %s: %s' % (index.storage_id, e))
+            return None
+        if qt_delta is not None:
+            index.apply_delta(qt_delta['Items'], qt_delta['Deleted'], qt_delta['HighWaterMark'])
+        return qt_delta
+
+    def _forget_indexed_books(self, paths):
+        # drop deleted books from the BookIndex right away, so their recorded uploads can not be reused.
+        for storage_id, booklist in self.booklists.values():
+            books = [booklist.find_book_by_path(path) for path in paths]
+            book_ids = [book.quietthyme_id for book in books if book is not None and book.quietthyme_id != -1]
+            if book_ids:
+                BookIndex(storage_id).apply_delta([], book_ids, None)
+
+    def _books_from_quietthyme_metadata(self, qt_booklist):
+        # the total number of books is not known while the listing is streamed in, so progress is indeterminate.
+        thumbnails = ThumbnailCache.default()
+        for qt_chunk in self._chunks(qt_booklist, 100):
+            self.report_progress(-1, _('Loading books from device...'))
+            qt_chunk = [qt_metadata for qt_metadata in qt_chunk if qt_metadata['storage_identifier']]
+
+            # download any covers missing from the thumbnail cache in parallel, before the Books read them from disk.
+            thumbnails.prefetch([qt_metadata.get('cover') for qt_metadata in qt_chunk])
+            for qt_metadata in qt_chunk:
+                #logger.debug(qt_metadata)
+                yield Book.from_quietthyme_metadata(qt_metadata)
+
     ####################################################################################################################
     # Generic Helper Functions
 
+    @classmethod
+    def _content_hash(cls, local_file):
+        with file_source(local_file) as source:
+            return source.hash('sha1')
+
+    @classmethod
+    def _chunks(cls, iterable, size):
+        chunk = []
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
     @classmethod
     def _convert_oncard_to_cardid(cls, oncard):
         if oncard == None:
@@ -0,0 +1,549 @@
+__author__ = 'jason'
+import unittest, json, os, shutil, tempfile, threading, urlparse, zlib, BaseHTTPServer, SocketServer
+from calibre.ebooks.metadata.book.base import Metadata
+from calibre_plugins.quietthyme import QuietthymeDevicePlugin
+from calibre_plugins.quietthyme.config import prefs
+from calibre_plugins.quietthyme.client.api import ApiClient
+from calibre_plugins.quietthyme.client.requestmanager import RequestManager
+from calibre_plugins.quietthyme.client.retry import RetryPolicy, RequestError
+from calibre_plugins.quietthyme.client.uploadjournal import UploadJournal
+from calibre_plugins.quietthyme.client.filesource import FileSource
+from calibre_plugins.quietthyme.client.thumbnailcache import ThumbnailCache
+from calibre_plugins.quietthyme.client import uploadjournal
+from calibre_plugins.quietthyme.models import bookindex
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    A minimal local stand-in for the QuietThyme /book and /storage endpoints.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        args = dict(urlparse.parse_qsl(url.query))
+        if url.path.startswith('/v1/storage/'):
+            book_id = url.path.rsplit('/', 1)[1]
+            file_url = self._file_url(book_id)
+            if book_id in self.server.redirects:
+                file_url = file_url.replace('/files/', '/redirect/')
+            self._send_json({'success': True, 'data': {'url': file_url}})
+            return
+        if url.path.startswith('/redirect/'):
+            self.send_response(302)
+            self.send_header('Location', self._file_url(url.path.rsplit('/', 1)[1]))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.server.listing_failures > 0:
+            self.server.listing_failures -= 1
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if url.path.startswith('/files/'):
+            book_id = url.path.rsplit('/', 1)[1]
+            if self.server.file_failures.get(book_id, 0) > 0:
+                self.server.file_failures[book_id] -= 1
+                self._send_body(500, 'text/plain', 'failure')
+            else:
+                self._send_body(200, 'application/epub+zip', self.server.file_contents.get(book_id, 'contents of book %s' % book_id))
+            return
+        self.server.requests.append(args)
+
+        books = self.server.books
+        deleted = []
+        if 'modified_since' in args:
+            if not self.server.supports_delta:
+                self._send_json({'success': True, 'data': {'Items': books, 'LastEvaluatedKey': ""}})
+                return
+            modified_since = int(args['modified_since'])
+            books = [book for book in books if book['last_modified'] > modified_since]
+            deleted = [book_id for book_id, deleted_at in self.server.deleted if deleted_at > modified_since]
+        if 'total_segments' in args:
+            total_segments = int(args['total_segments'])
+            books = [book for book in books if book['id'] % total_segments == int(args['segment'])]
+
+        # two books per page, the page cursor is the offset of the next page.
+        offset = int(args.get('page', 0))
+        items = books[offset:offset + 2]
+        next_page = str(offset + 2) if offset + 2 < len(books) else ""
+        data = {'Items': items, 'LastEvaluatedKey': next_page}
+        if self.server.supports_delta:
+            data['HighWaterMark'] = str(self.server.clock)
+            data['Deleted'] = deleted if offset == 0 else []
+        self._send_json({'success': True, 'data': data})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.request_encodings.append(self.headers.get('Content-Encoding'))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        payloads = json.loads(body)
+        path = urlparse.urlparse(self.path).path
+        if path == '/v1/book':
+            self._send_json(self._create_book(payloads))
+            return
+        if path == '/v1/storage/prepare/book':
+            self._send_json(self._prepare_book(payloads))
+            return
+        if self.path == '/v1/storage/prepare/book/multipart':
+            upload_id = payloads.get('upload_id')
+            if upload_id not in self.server.uploads:
+                upload_id = 'upload-%d' % len(self.server.uploads)
+                self.server.uploads[upload_id] = {}
+            part_urls = ['http://127.0.0.1:%d/parts/%s/%d' % (self.server.server_address[1], upload_id, part_number)
+                         for part_number in range(1, payloads['part_count'] + 1)]
+            self._send_json({'success': True, 'data': {'upload_id': upload_id, 'part_urls': part_urls,
+                                                       'book_data': {'storage_size': payloads['storage_size']}}})
+            return
+        if self.path == '/v1/storage/complete/book/multipart':
+            parts = self.server.uploads[payloads['upload_id']]
+            self.server.completed.append(''.join(parts[part['part_number']] for part in payloads['parts']))
+            self._send_json({'success': True, 'data': {}})
+            return
+        if path.endswith('/batch') and self.server.batch_status is not None:
+            self._send_body(self.server.batch_status, 'text/plain', 'batch failure')
+            return
+        if self.path == '/v1/book/delete/batch' and self.server.supports_batch:
+            self.server.batch_requests.append(payloads)
+            self._send_json({'success': True, 'data': [self._delete_book(payload['book_id']) for payload in payloads]})
+            return
+        if path in ('/v1/book/batch', '/v1/storage/prepare/book/batch') and self.server.supports_batch:
+            self.server.batch_requests.append(payloads)
+            handler = self._create_book if path == '/v1/book/batch' else self._prepare_book
+            data = [handler(payload) for payload in payloads]
+            # one item short, like a server that dropped an item.
+            if self.server.batch_truncated:
+                data = data[:-1]
+            self._send_json({'success': True, 'data': data})
+            return
+        self._send_body(404, 'text/plain', 'not found')
+
+    def _create_book(self, payload):
+        if payload['title'] in self.server.create_failures:
+            return {'success': False, 'error_msg': 'Could not create %s' % payload['title']}
+        book_id = self.server.book_ids.setdefault(payload['title'], 100 + len(self.server.book_ids))
+        return {'success': True, 'data': {'id': book_id}}
+
+    def _prepare_book(self, payload):
+        upload_url = 'http://127.0.0.1:%d/stored/%s' % (self.server.server_address[1], payload['book_id'])
+        return {'success': True, 'data': {'upload_url': upload_url,
+                                          'book_data': {'storage_size': payload['storage_size']}}}
+
+    def do_DELETE(self):
+        self._send_json(self._delete_book(self.path.rsplit('/', 1)[1]))
+
+    def _delete_book(self, book_id):
+        if book_id in self.server.delete_failures:
+            return {'success': False, 'error_msg': 'Could not delete book %s' % book_id}
+        self.server.deleted_books.append(book_id)
+        return {'success': True, 'data': {}}
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path.startswith('/stored/'):
+            self.server.stored[int(self.path.rsplit('/', 1)[1])] = body
+            self._send_body(200, 'text/plain', '')
+            return
+        upload_id, part_number = self.path.split('/')[2:]
+        self.server.part_requests.append(int(part_number))
+        if self.server.part_failures.get(int(part_number), 0) > 0:
+            self.server.part_failures[int(part_number)] -= 1
+            self._send_body(500, 'text/plain', 'failure')
+            return
+        self.server.uploads[upload_id][int(part_number)] = body
+        self.send_response(200)
+        self.send_header('ETag', '"%s-%s"' % (upload_id, part_number))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _file_url(self, book_id):
+        return 'http://127.0.0.1:%d/files/%s' % (self.server.server_address[1], book_id)
+
+    def _send_json(self, data):
+        body = json.dumps(data)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._send_body(200, 'application/json', compressor.compress(body) + compressor.flush(), 'gzip')
+        else:
+            self._send_body(200, 'application/json', body)
+
+    def _send_body(self, status, content_type, body, content_encoding=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if content_encoding:
+            self.server.response_encodings.append(content_encoding)
+            self.send_header('Content-Encoding', content_encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, books):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.books = books
+        self.requests = []
+        # (book id, deleted at) tombstones, and the current modification clock.
+        self.deleted = []
+        self.clock = 0
+        self.supports_delta = True
+        # the number of requests answered with 503 (and a Retry-After) before serving normally.
+        self.listing_failures = 0
+        # the payloads of every batch request.
+        self.batch_requests = []
+        self.supports_batch = True
+        # the status every batch request is answered with, instead of serving it.
+        self.batch_status = None
+        # the number of times each book file download fails before it succeeds.
+        self.file_failures = {}
+        # the contents of book files, by book id, instead of 'contents of book <id>', and the ids of the books
+        # whose signed url redirects to the file.
+        self.file_contents = {}
+        self.redirects = set()
+        # multipart uploads, by upload id, and the number of times each part upload fails.
+        self.uploads = {}
+        self.completed = []
+        self.part_requests = []
+        self.part_failures = {}
+        # the ids of the created books by title, the titles of the books that can not be created, and whether
+        # batch responses leave out their last item.
+        self.book_ids = {}
+        self.create_failures = set()
+        self.batch_truncated = False
+        # the uploaded (not multipart) files, by book id.
+        self.stored = {}
+        # the ids of the deleted books, and the ids of the books that can not be deleted.
+        self.deleted_books = []
+        self.delete_failures = set()
+        # the Content-Encoding of every POST body, and of every compressed response.
+        self.request_encodings = []
+        self.response_encodings = []
+
+class StandInServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.books = [{'id': i, 'title': 'Book %d' % i, 'last_modified': 1} for i in range(11)]
+        self.server = StandInServer(self.books)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.api_base = prefs['api_base']
+        prefs['api_base'] = 'http://127.0.0.1:%d/v1' % self.server.server_address[1]
+        self.client = ApiClient()
+
+        # retry without waiting, and start every test with closed circuit breakers and fresh rate limits.
+        self.retry_policy = RequestManager.retry_policy
+        RequestManager.retry_policy = RetryPolicy(base_delay=0, idempotent_endpoints=self.retry_policy.idempotent_endpoints)
+        RequestManager.circuit_breakers = {}
+        RequestManager.rate_limiters = {}
+
+    def tearDown(self):
+        RequestManager.retry_policy = self.retry_policy
+        RequestManager.circuit_breakers = {}
+        prefs['api_base'] = self.api_base
+        self.server.shutdown()
+        self.server.server_close()
+
+class TestApiClient(StandInServerTestCase):
+    def test_books_iter(self):
+        ids = [item['id'] for item in self.client.books_iter('storage-id')]
+        self.assertEqual(ids, range(11))
+        self.assertEqual(len(self.server.requests), 6)
+
+    def test_books_segmented(self):
+        ids = [item['id'] for item in self.client.books_segmented('storage-id', 3)]
+        self.assertEqual(sorted(ids), range(11))
+        self.assertEqual(set(args['segment'] for args in self.server.requests), set(['0', '1', '2']))
+        for args in self.server.requests:
+            self.assertEqual(args['total_segments'], '3')
+            self.assertEqual(args['storage_id'], 'storage-id')
+
+    def test_books_segmented_single_segment(self):
+        ids = [item['id'] for item in self.client.books_segmented('storage-id', 1)]
+        self.assertEqual(ids, range(11))
+
+    def test_books_iter_listing_info(self):
+        self.server.clock = 5
+        listing_info = {}
+        list(self.client.books_iter('storage-id', listing_info))
+        self.assertEqual(listing_info['HighWaterMark'], '5')
+
+    def test_books_changed(self):
+        self.server.clock = 5
+        self.books[3]['last_modified'] = 4
+        self.books[4]['last_modified'] = 5
+        self.server.deleted.append((20, 3))
+        self.server.deleted.append((21, 1))
+
+        qt_delta = self.client.books_changed('storage-id', '2')
+        self.assertEqual([item['id'] for item in qt_delta['Items']], [3, 4])
+        self.assertEqual(qt_delta['Deleted'], [20])
+        self.assertEqual(qt_delta['HighWaterMark'], '5')
+        self.assertEqual(self.server.requests[0]['modified_since'], '2')
+
+    def test_books_changed_unsupported(self):
+        self.server.supports_delta = False
+        self.assertEqual(self.client.books_changed('storage-id', '2'), None)
+
+    def test_upload_bookstorage_multipart_resume(self):
+        tempdir = tempfile.mkdtemp()
+        part_size = prefs['multipart_part_size']
+        prefs['multipart_part_size'] = 4
+        try:
+            local_filepath = os.path.join(tempdir, 'book.epub')
+            with open(local_filepath, 'wb') as f:
+                f.write('0123456789abcdef01')
+            journal = UploadJournal(os.path.join(tempdir, 'uploads.json'))
+            qt_storage_metadata = {'book_id': 1, 'storage_id': 'storage-id', 'storage_size': 18}
+
+            # part 2 keeps failing, so the first attempt is interrupted.
+            self.server.part_failures = {2: RequestManager.retry_policy.max_attempts}
+            self.assertRaises(RequestError, self.client.upload_bookstorage_multipart, qt_storage_metadata, local_filepath, journal)
+            self.assertEqual(self.server.completed, [])
+
+            del self.server.part_requests[:]
+            qt_book_data = self.client.upload_bookstorage_multipart(qt_storage_metadata, local_filepath, journal)
+            self.assertEqual(qt_book_data, {'storage_size': 18})
+            self.assertEqual(self.server.part_requests, [2])
+            self.assertEqual(self.server.completed, ['0123456789abcdef01'])
+            with FileSource(local_filepath) as source:
+                self.assertEqual(journal.get(UploadJournal.key('storage-id', 1, source)), None)
+        finally:
+            prefs['multipart_part_size'] = part_size
+            shutil.rmtree(tempdir)
+
+    def test_create_books(self):
+        self.server.create_failures = set(['Book 3'])
+        batch_size = prefs['batch_size']
+        prefs['batch_size'] = 2
+        try:
+            created = self.client.create_books([Metadata('Book %d' % i, ['Author']) for i in range(5)])
+        finally:
+            prefs['batch_size'] = batch_size
+        self.assertEqual([len(payloads) for payloads in self.server.batch_requests], [2, 2, 1])
+        self.assertEqual([qt_metadata['id'] if qt_metadata else None for qt_metadata, error_msg in created],
+                         [100, 101, 102, None, 103])
+        self.assertEqual([error_msg for qt_metadata, error_msg in created], [None, None, None, 'Could not create Book 3', None])
+        self.assertEqual(created[4][0]['title'], 'Book 4')
+
+    def test_create_books_without_batch(self):
+        self.server.supports_batch = False
+        self.assertEqual(self.client.create_books([Metadata('Book', ['Author'])]), None)
+
+    def test_create_books_invalid_batch_response(self):
+        self.server.batch_truncated = True
+        batch_size = prefs['batch_size']
+        prefs['batch_size'] = 2
+        try:
+            created = self.client.create_books([Metadata('Book %d' % i, ['Author']) for i in range(3)])
+        finally:
+            prefs['batch_size'] = batch_size
+        # every item of a chunk whose response has the wrong length failed, not only the missing one.
+        self.assertEqual([qt_metadata for qt_metadata, error_msg in created], [None, None, None])
+        self.assertEqual(set(error_msg for qt_metadata, error_msg in created),
+                         set(['Invalid response to batch request /book/batch']))
+
+    def test_create_books_batch_failure(self):
+        self.server.batch_status = 500
+        created = self.client.create_books([Metadata('Book %d' % i, ['Author']) for i in range(2)])
+        self.assertEqual(len(created), 2)
+        self.assertTrue(all(qt_metadata is None and error_msg for qt_metadata, error_msg in created))
+
+    def test_prepare_bookstorage_many(self):
+        batch_size = prefs['batch_size']
+        prefs['batch_size'] = 2
+        try:
+            results = self.client.prepare_bookstorage_many([{'book_id': i, 'storage_size': i * 10} for i in range(3)])
+        finally:
+            prefs['batch_size'] = batch_size
+        self.assertEqual([len(payloads) for payloads in self.server.batch_requests], [2, 1])
+        self.assertEqual([qt_upload_data['upload_url'].rsplit('/', 1)[1] for qt_upload_data, error_msg in results], ['0', '1', '2'])
+        self.assertEqual([qt_upload_data['book_data'] for qt_upload_data, error_msg in results],
+                         [{'storage_size': 0}, {'storage_size': 10}, {'storage_size': 20}])
+        self.assertEqual([error_msg for qt_upload_data, error_msg in results], [None, None, None])
+
+    def test_prepare_bookstorage_many_without_batch(self):
+        self.server.supports_batch = False
+        self.assertEqual(self.client.prepare_bookstorage_many([{'book_id': 1, 'storage_size': 10}]), None)
+
+    def test_retry_after(self):
+        self.server.listing_failures = 2
+        ids = [item['id'] for item in self.client.books_iter('storage-id')]
+        self.assertEqual(ids, range(11))
+
+    def test_destroy_books(self):
+        self.server.delete_failures = set(['2'])
+        errors = self.client.destroy_books(['storage://1/a.epub', 'storage://2/b.epub', 'invalid', 'storage://3/c.epub'])
+        self.assertEqual(errors[0], None)
+        self.assertEqual(errors[1], 'Could not delete book 2')
+        self.assertTrue(errors[2].startswith('Invalid QuietThyme storage path'))
+        self.assertEqual(errors[3], None)
+        self.assertEqual(self.server.batch_requests, [[{'book_id': '1'}, {'book_id': '2'}, {'book_id': '3'}]])
+        self.assertEqual(self.server.deleted_books, ['1', '3'])
+
+    def test_destroy_books_nothing_to_delete(self):
+        progress = []
+        errors = self.client.destroy_books(['invalid'], lambda completed, total: progress.append(completed / total))
+        self.assertTrue(errors[0].startswith('Invalid QuietThyme storage path'))
+        self.assertEqual(self.client.destroy_books([], lambda completed, total: progress.append(completed / total)), [])
+        self.assertEqual(progress, [])
+        self.assertEqual(self.server.batch_requests, [])
+
+    def test_destroy_books_without_batch(self):
+        self.server.supports_batch = False
+        self.server.delete_failures = set(['2'])
+        progress = []
+        errors = self.client.destroy_books(['storage://%d/book.epub' % i for i in range(1, 6)],
+                                           lambda completed, total: progress.append(completed))
+        self.assertEqual(errors, [None, 'Could not delete book 2', None, None, None])
+        self.assertEqual(sorted(self.server.deleted_books), ['1', '3', '4', '5'])
+        self.assertEqual(progress, [1, 2, 3, 4, 5])
+
+    def test_destroy_books_batch_failure(self):
+        # a failed batch request is not mistaken for a missing batch endpoint.
+        self.server.batch_status = 400
+        errors = self.client.destroy_books(['storage://1/a.epub', 'storage://2/b.epub'])
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(all(errors))
+        self.assertEqual(self.server.deleted_books, [])
+
+    def test_compression(self):
+        self.assertEqual([item['id'] for item in self.client.books_iter('storage-id')], range(11))
+        self.assertEqual(self.server.response_encodings, ['gzip'] * 6)
+
+        compress_requests, min_size = prefs['compress_requests'], prefs['compress_requests_min_size']
+        prefs['compress_requests'] = True
+        try:
+            self.assertEqual(self.client.destroy_books(['storage://1/a.epub', 'storage://2/b.epub']), [None, None])
+            # the batch request is too small to be worth compressing.
+            self.assertEqual(self.server.request_encodings, [None])
+
+            prefs['compress_requests_min_size'] = 0
+            self.client.destroy_books(['storage://3/c.epub'])
+            self.assertEqual(self.server.request_encodings, [None, 'gzip'])
+        finally:
+            prefs['compress_requests'], prefs['compress_requests_min_size'] = compress_requests, min_size
+
+    def test_request_error(self):
+        self.server.listing_failures = 100
+        self.assertRaises(RequestError, self.client.books, 'storage-id')
+        self.assertEqual(self.server.listing_failures, 100 - RequestManager.retry_policy.max_attempts)
+
+
+class TestBatchUploads(StandInServerTestCase):
+    def setUp(self):
+        StandInServerTestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        # keep the book index, upload journal and covers of the plugin out of the calibre config directory.
+        self.config_dirs = bookindex.config_dir, uploadjournal.config_dir
+        bookindex.config_dir = uploadjournal.config_dir = self.tempdir
+        self.thumbnails = ThumbnailCache._default
+        ThumbnailCache._default = ThumbnailCache(os.path.join(self.tempdir, 'thumbnails'), 1024)
+        self.upload_prefs = dict((name, prefs[name]) for name in ('batch_size', 'multipart_threshold', 'multipart_part_size'))
+
+        self.plugin = QuietthymeDevicePlugin(None)
+        self.plugin._refresh_status = lambda: None
+        self.plugin.qt_settings = {'main': {'storage_id': 'storage-id'}}
+
+    def tearDown(self):
+        for name, value in self.upload_prefs.items():
+            prefs[name] = value
+        ThumbnailCache._default = self.thumbnails
+        bookindex.config_dir, uploadjournal.config_dir = self.config_dirs
+        shutil.rmtree(self.tempdir)
+        StandInServerTestCase.tearDown(self)
+
+    def create_jobs(self, sizes):
+        jobs = []
+        for i, size in enumerate(sizes):
+            local_filepath = os.path.join(self.tempdir, '%d.epub' % i)
+            with open(local_filepath, 'wb') as f:
+                f.write(str(i) * size)
+            jobs.append((local_filepath, Metadata('Book %d' % i, ['Author'])))
+        return jobs
+
+    def test_prepare_uploads_batched(self):
+        self.server.create_failures = set(['Book 1'])
+        prepared = self.plugin._prepare_uploads_batched(self.create_jobs([10, 10, 10]), 'storage-id')
+        self.assertEqual([len(payloads) for payloads in self.server.batch_requests], [3, 2])
+        self.assertEqual(prepared[1], (None, None, None, 'Could not create Book 1'))
+        for i, book_id in ((0, 100), (2, 101)):
+            qt_book_data, upload_url, content_hash, error_msg = prepared[i]
+            self.assertEqual(qt_book_data['id'], book_id)
+            self.assertEqual(qt_book_data['storage_size'], 10)
+            self.assertTrue(upload_url.endswith('/stored/%d' % book_id))
+            self.assertEqual(error_msg, None)
+
+    def test_prepare_uploads_batched_without_batch(self):
+        self.server.supports_batch = False
+        self.assertEqual(self.plugin._prepare_uploads_batched(self.create_jobs([10, 10]), 'storage-id'), None)
+
+    def test_upload_books_batched_and_multipart(self):
+        prefs['batch_size'] = 4
+        prefs['multipart_threshold'] = 100
+        prefs['multipart_part_size'] = 64
+        # the large book is uploaded in parts on its own, the others with batch requests.
+        jobs = self.create_jobs([10, 200, 20, 30])
+        dest_info = self.plugin.upload_books([local_filepath for local_filepath, local_metadata in jobs],
+                                             ['book.epub'] * 4, metadata=[local_metadata for local_filepath, local_metadata in jobs])
+
+        book_ids = self.server.book_ids
+        self.assertEqual([qt_book_data['id'] for card_id, qt_book_data in dest_info],
+                         [book_ids['Book 0'], book_ids['Book 1'], book_ids['Book 2'], book_ids['Book 3']])
+        self.assertEqual([len(payloads) for payloads in self.server.batch_requests], [3, 3])
+        self.assertEqual(self.server.stored, {book_ids['Book 0']: '0' * 10, book_ids['Book 2']: '2' * 20,
+                                              book_ids['Book 3']: '3' * 30})
+        self.assertEqual(self.server.completed, ['1' * 200])
+
+
+class StandInOutfile(object):
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+class TestGetFile(StandInServerTestCase):
+    def setUp(self):
+        StandInServerTestCase.setUp(self)
+        self.progress = []
+        self.plugin = QuietthymeDevicePlugin(None)
+        self.plugin.report_progress = lambda fraction, text: self.progress.append(fraction)
+
+    def test_get_file(self):
+        # larger than one 64KB chunk, the book is written as it is received.
+        self.server.file_contents['1'] = 'a' * 100000
+        outfile = StandInOutfile()
+        self.plugin.get_file('dropbox://1/Book.epub', outfile)
+        self.assertEqual(''.join(outfile.chunks), 'a' * 100000)
+        self.assertTrue(len(outfile.chunks) > 1)
+        self.assertTrue(max(len(chunk) for chunk in outfile.chunks) <= 64 * 1024)
+        self.assertEqual(self.progress[-1], 1.0)
+        self.assertEqual(self.progress, sorted(self.progress))
+        self.assertEqual(len(self.progress), len(outfile.chunks))
+
+    def test_get_file_redirect(self):
+        self.server.redirects.add('2')
+        outfile = StandInOutfile()
+        self.plugin.get_file('dropbox://2/Book.epub', outfile)
+        self.assertEqual(''.join(outfile.chunks), 'contents of book 2')
+
+    def test_get_file_error(self):
+        self.server.file_failures['3'] = 1
+        outfile = StandInOutfile()
+        with self.assertRaises(RequestError) as context:
+            self.plugin.get_file('dropbox://3/Book.epub', outfile)
+        self.assertEqual(context.exception.status, 500)
+        self.assertEqual(outfile.chunks, [])
+
+
+suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(TestApiClient),
+                            unittest.TestLoader().loadTestsFromTestCase(TestBatchUploads),
+                            unittest.TestLoader().loadTestsFromTestCase(TestGetFile)])
+unittest.TextTestRunner(verbosity=2).run(suite)
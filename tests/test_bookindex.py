@@ -0,0 +1,98 @@
+__author__ = 'jason'
+import unittest, os, shutil, tempfile
+from calibre_plugins.quietthyme.models.bookindex import BookIndex
+
+class TestBookIndex(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.index = BookIndex('storage-id', db_path=os.path.join(self.tempdir, 'books.sqlite'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_items_empty(self):
+        self.assertEqual(self.index.items(), [])
+
+    def test_sync_yields_and_stores_items(self):
+        qt_items = [{'id': 1, 'title': 'One', 'last_modified': 'a'}, {'id': 2, 'title': 'Two', 'last_modified': 'a'}]
+        self.assertEqual(list(self.index.sync(qt_items)), qt_items)
+        self.assertEqual(self.index.items(), qt_items)
+
+    def test_sync_updates_changed_and_removes_missing(self):
+        list(self.index.sync([{'id': 1, 'title': 'One', 'last_modified': 'a'},
+                              {'id': 2, 'title': 'Two', 'last_modified': 'a'}]))
+        list(self.index.sync([{'id': 1, 'title': 'One (revised)', 'last_modified': 'b'},
+                              {'id': 3, 'title': 'Three', 'last_modified': 'a'}]))
+        self.assertEqual([item['title'] for item in self.index.items()], ['One (revised)', 'Three'])
+
+    def test_sync_keeps_listing_order(self):
+        list(self.index.sync([{'id': i, 'title': str(i), 'last_modified': 'a'} for i in (1, 2, 3)]))
+        list(self.index.sync([{'id': i, 'title': str(i), 'last_modified': 'a'} for i in (4, 1, 3)]))
+        self.assertEqual([item['id'] for item in self.index.items()], [4, 1, 3])
+        list(self.index.sync([{'id': i, 'title': str(i), 'last_modified': 'a'} for i in (1, 3, 4)]))
+        self.assertEqual([item['id'] for item in self.index.items()], [1, 3, 4])
+
+    def test_storages_are_separate(self):
+        other = BookIndex('other-storage-id', db_path=self.index.db_path)
+        list(self.index.sync([{'id': 1, 'title': 'One', 'last_modified': 'a'}]))
+        self.assertEqual(other.items(), [])
+
+    def test_clear(self):
+        list(self.index.sync([{'id': 1, 'title': 'One', 'last_modified': 'a'}]))
+        self.index.clear()
+        self.assertEqual(self.index.items(), [])
+
+    def test_high_water_mark(self):
+        self.assertEqual(self.index.high_water_mark(), None)
+        list(self.index.sync([{'id': 1, 'title': 'One', 'last_modified': 'a'}], {'HighWaterMark': '10'}))
+        self.assertEqual(self.index.high_water_mark(), '10')
+
+    def test_apply_delta(self):
+        list(self.index.sync([{'id': 1, 'title': 'One', 'last_modified': 'a'},
+                              {'id': 2, 'title': 'Two', 'last_modified': 'a'}], {'HighWaterMark': '10'}))
+        self.index.apply_delta([{'id': 1, 'title': 'One (revised)', 'last_modified': 'b'},
+                                {'id': 3, 'title': 'Three', 'last_modified': 'b'}], [2], '12')
+        self.assertEqual([item['title'] for item in self.index.items()], ['One (revised)', 'Three'])
+        self.assertEqual(self.index.high_water_mark(), '12')
+
+    def test_apply_delta_keeps_positions(self):
+        list(self.index.sync([{'id': i, 'title': str(i), 'last_modified': 'a'} for i in (1, 2, 3)]))
+        self.index.apply_delta([{'id': 4, 'title': '4', 'last_modified': 'b'},
+                                {'id': 1, 'title': '1 (revised)', 'last_modified': 'b'},
+                                {'id': 5, 'title': '5', 'last_modified': 'b'}], [], '12')
+        self.assertEqual([item['title'] for item in self.index.items()], ['1 (revised)', '2', '3', '4', '5'])
+
+    def test_sync_keeps_delta_applied_meanwhile(self):
+        list(self.index.sync([{'id': i, 'title': str(i), 'last_modified': 'a'} for i in (1, 2, 3)], {'HighWaterMark': '10'}))
+        listing = self.index.sync([{'id': 1, 'title': '1 (listed)', 'last_modified': 'b'},
+                                   {'id': 3, 'title': '3', 'last_modified': 'a'}], {'HighWaterMark': '11'})
+        listing.next()
+        # a newer delta is applied before the listing is exhausted.
+        self.index.apply_delta([{'id': 1, 'title': '1 (delta)', 'last_modified': 'c'},
+                                {'id': 4, 'title': '4', 'last_modified': 'c'}], [3], '12')
+        list(listing)
+        self.assertEqual([item['title'] for item in self.index.items()], ['1 (delta)', '4'])
+        self.assertEqual(self.index.high_water_mark(), '12')
+
+    def test_get(self):
+        list(self.index.sync([{'id': 1, 'title': 'One', 'last_modified': 'a'}]))
+        self.assertEqual(self.index.get(1)['title'], 'One')
+        self.assertEqual(self.index.get(2), None)
+
+    def test_record_upload(self):
+        self.assertEqual(self.index.last_upload(1), (None, None))
+        self.index.record_upload({'id': 1, 'storage_format': '.epub'}, 'hash')
+        self.assertEqual(self.index.last_upload(1), ('hash', {'id': 1, 'storage_format': '.epub'}))
+
+        # recorded uploads survive listings, but not the removal of the book.
+        list(self.index.sync([{'id': 1, 'title': 'One', 'last_modified': 'a'}]))
+        self.assertEqual(self.index.last_upload(1)[0], 'hash')
+        self.index.apply_delta([], [1], None)
+        self.assertEqual(self.index.last_upload(1), (None, None))
+
+        self.index.record_upload({'id': 2, 'storage_format': '.epub'}, None)
+        self.assertEqual(self.index.last_upload(2), (None, None))
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestBookIndex)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,107 @@
+__author__ = 'jason'
+import unittest
+from calibre_plugins.quietthyme.models.book import Book
+from calibre_plugins.quietthyme.models.booklist import BookList
+
+def create_book(quietthyme_id, title='Title'):
+    book = Book()
+    book.title = title
+    book.quietthyme_id = quietthyme_id
+    book.path = 'dropbox://%s/%s.epub' % (quietthyme_id, title)
+    return book
+
+class TestBookList(unittest.TestCase):
+    def setUp(self):
+        self.booklist = BookList(None, None, None)
+
+    def assertIndexed(self):
+        self.assertEqual(set(self.booklist._bookmap.keys()),
+                         set(book.quietthyme_id for book in self.booklist if book.quietthyme_id != -1))
+        self.assertEqual(set(self.booklist._pathmap.keys()), set(book.path for book in self.booklist))
+
+    def test_add_book(self):
+        book = create_book(1)
+        self.assertIs(self.booklist.add_book(book, False), book)
+        self.assertIs(self.booklist.find_book(create_book(1)), book)
+        self.assertIs(self.booklist.find_book_by_path(book.path), book)
+        self.assertIndexed()
+
+    def test_add_book_duplicate(self):
+        self.booklist.add_book(create_book(1), False)
+        self.assertEqual(self.booklist.add_book(create_book(1), False), None)
+        self.assertEqual(len(self.booklist), 1)
+
+    def test_add_book_replace_metadata(self):
+        book = create_book(1)
+        self.booklist.add_book(book, False)
+        self.assertIs(self.booklist.add_book(create_book(1, 'Other Title'), True), book)
+        self.assertEqual(book.title, 'Other Title')
+        self.assertIndexed()
+
+    def test_add_book_placeholder(self):
+        self.booklist.add_book(create_book(-1), False)
+        self.booklist.add_book(create_book(-1), False)
+        self.assertEqual(len(self.booklist), 2)
+        self.assertIndexed()
+
+    def test_remove_book(self):
+        books = [create_book(i) for i in range(3)]
+        for book in books:
+            self.booklist.add_book(book, False)
+        self.booklist.remove_book(books[1])
+        self.assertEqual(self.booklist.find_book(books[1]), None)
+        self.assertEqual(self.booklist.find_book_by_path(books[1].path), None)
+        self.assertEqual(len(self.booklist), 2)
+        self.assertIndexed()
+
+    def test_remove_book_without_eq(self):
+        placeholder = create_book(-1)
+        self.booklist.add_book(placeholder, False)
+        for i in range(3):
+            self.booklist.add_book(create_book(i), False)
+        self.booklist.remove(placeholder)
+        self.booklist.remove(create_book(1))
+        self.assertEqual([book.quietthyme_id for book in self.booklist], [0, 2])
+        self.assertRaises(ValueError, self.booklist.remove, create_book(1))
+        self.assertIndexed()
+
+    def test_setitem_and_slices(self):
+        for i in range(5):
+            self.booklist.add_book(create_book(i), False)
+        self.booklist[0] = create_book(10)
+        del self.booklist[1]
+        self.booklist[:] = [book for book in self.booklist if book.quietthyme_id != 3]
+        self.assertEqual([book.quietthyme_id for book in self.booklist], [10, 2, 4])
+        self.assertIndexed()
+
+    def test_apply_delta(self):
+        for i in range(3):
+            self.booklist.add_book(create_book(i), False)
+        self.booklist.apply_delta([create_book(1, 'Revised'), create_book(5)], [0])
+        self.assertEqual([book.quietthyme_id for book in self.booklist], [1, 2, 5])
+        self.assertEqual(self.booklist.find_book(create_book(1)).title, 'Revised')
+        self.assertIndexed()
+
+    def test_remove_books_by_path(self):
+        books = [create_book(i) for i in range(5)]
+        for book in books:
+            self.booklist.add_book(book, False)
+        removed = self.booklist.remove_books_by_path([books[1].path, 'prefix/' + books[3].path, books[1].path,
+                                                        'missing.epub'])
+        self.assertEqual(sorted(book.quietthyme_id for book in removed), [1, 3])
+        self.assertEqual([book.quietthyme_id for book in self.booklist], [0, 2, 4])
+        self.assertIndexed()
+
+    def test_from_quietthyme_metadata(self):
+        book = Book.from_quietthyme_metadata({
+            'id': 1, 'title': 'Title', 'authors': ['Author'], 'tags': ['tag'], 'storage_size': 10,
+            'storage_type': 'dropbox', 'storage_filename': 'Title', 'storage_format': '.epub', 'amazon_id': 'B00'})
+        self.assertEqual(book.title, 'Title')
+        self.assertEqual(book.authors, ['Author'])
+        self.assertEqual(book.path, 'dropbox://1/Title.epub')
+        self.assertEqual(book.identifiers['amazon'], 'B00')
+        self.assertEqual(book.quietthyme_id, 1)
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestBookList)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,133 @@
+__author__ = 'jason'
+import unittest, errno, httplib, socket, threading, BaseHTTPServer, SocketServer
+from calibre_plugins.quietthyme.client.connectionpool import ConnectionPool
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    A minimal keep-alive server, /close answers with Connection: close.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        if self.path == '/close':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write('ok')
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # connections the pool closes with an unread response are reset.
+        pass
+
+class StandInConnection(object):
+    '''
+    A connection that fails with the given error when the request is sent or when the response is read.
+    '''
+    def __init__(self, send_error=None, read_error=None):
+        self.send_error = send_error
+        self.read_error = read_error
+        self.requests = []
+        self.closed = False
+
+    def request(self, method, path, body=None, headers=None):
+        self.requests.append((method, path))
+        if self.send_error:
+            raise self.send_error
+
+    def getresponse(self):
+        if self.read_error:
+            raise self.read_error
+        return 'response'
+
+    def close(self):
+        self.closed = True
+
+class StandInPool(ConnectionPool):
+    def __init__(self, stale):
+        ConnectionPool.__init__(self)
+        self._idle[('https', 'example.com')] = [stale]
+        self.fresh = []
+
+    def _new_connection(self, scheme, host):
+        conn = StandInConnection()
+        self.fresh.append(conn)
+        return conn
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(('127.0.0.1', 0), StandInHandler)
+        self.server.connections = set()
+        self.host = '127.0.0.1:%d' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever).start()
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, path):
+        conn, response = self.pool.request('http', self.host, 'GET', path)
+        self.assertEqual(response.read(), 'ok')
+        self.pool.release(conn, response)
+        return conn
+
+    def test_reuses_connections(self):
+        conn = self.get('/')
+        self.assertIs(self.get('/'), conn)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_release_closes_will_close_connections(self):
+        self.get('/close')
+        self.assertEqual(self.pool._idle.get(('http', self.host), []), [])
+        self.get('/')
+        self.assertEqual(len(self.server.connections), 2)
+
+    def test_release_closes_unread_responses(self):
+        conn, response = self.pool.request('http', self.host, 'GET', '/')
+        self.pool.release(conn, response)
+        self.assertEqual(self.pool._idle.get(('http', self.host), []), [])
+
+    def assertRetried(self, method, stale, retried):
+        pool = StandInPool(stale)
+        if retried:
+            conn, response = pool.request('https', 'example.com', method, '/book', '{}')
+            self.assertIs(conn, pool.fresh[0])
+            self.assertEqual(conn.requests, [(method, '/book')])
+        else:
+            self.assertRaises(Exception, pool.request, 'https', 'example.com', method, '/book', '{}')
+            self.assertEqual(pool.fresh, [])
+        self.assertTrue(stale.closed)
+
+    def test_stale_connection_retried(self):
+        # the server closed or reset the idle connection, it never saw the request.
+        self.assertRetried('POST', StandInConnection(read_error=httplib.BadStatusLine("''")), True)
+        self.assertRetried('POST', StandInConnection(read_error=httplib.BadStatusLine(
+            'No status line received - the server has closed the connection')), True)
+        self.assertRetried('POST', StandInConnection(read_error=socket.error(errno.ECONNRESET, 'reset')), True)
+        self.assertRetried('POST', StandInConnection(send_error=socket.error(errno.EPIPE, 'broken pipe')), True)
+
+    def test_non_idempotent_requests_not_retried_after_sending(self):
+        self.assertRetried('POST', StandInConnection(read_error=socket.timeout('timed out')), False)
+        self.assertRetried('POST', StandInConnection(read_error=httplib.BadStatusLine('garbage')), False)
+        self.assertRetried('GET', StandInConnection(read_error=socket.timeout('timed out')), True)
+
+    def test_fresh_connection_not_retried(self):
+        pool = StandInPool(None)
+        pool._idle.clear()
+        conn = StandInConnection(read_error=socket.error(errno.ECONNRESET, 'reset'))
+        pool._new_connection = lambda scheme, host: conn
+        self.assertRaises(socket.error, pool.request, 'https', 'example.com', 'GET', '/')
+        self.assertEqual(conn.requests, [('GET', '/')])
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestConnectionPool)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,87 @@
+__author__ = 'jason'
+import unittest, time, socket, threading
+from calibre_plugins.quietthyme.config import prefs
+from calibre_plugins.quietthyme.client.connectivity import ConnectivityMonitor
+
+class TestConnectivityMonitor(unittest.TestCase):
+    def setUp(self):
+        self.results = []
+        self.probes = 0
+
+    def probe(self):
+        self.probes += 1
+        return self.results.pop(0)
+
+    def wait(self, monitor):
+        # let the background probe started by is_online() finish.
+        task = monitor._probe_task
+        if task is not None:
+            task.result()
+
+    def test_never_blocks(self):
+        release = threading.Event()
+        monitor = ConnectivityMonitor(probe=lambda: release.wait(5) or True)
+        start = time.time()
+        self.assertFalse(monitor.is_online())
+        self.assertTrue(time.time() - start < 0.5)
+        release.set()
+        self.wait(monitor)
+        self.assertTrue(monitor.is_online())
+
+    def test_ttl(self):
+        monitor = ConnectivityMonitor(probe=self.probe, ttl=0.1)
+        self.results = [True, True]
+        monitor.is_online()
+        self.wait(monitor)
+        for i in range(10):
+            self.assertTrue(monitor.is_online())
+        self.assertEqual(self.probes, 1)
+
+        time.sleep(0.15)
+        monitor.is_online()
+        self.wait(monitor)
+        self.assertEqual(self.probes, 2)
+
+    def test_backoff_while_offline(self):
+        monitor = ConnectivityMonitor(probe=self.probe, min_backoff=0.1, max_backoff=0.2)
+        self.results = [False, False, True]
+        monitor.is_online()
+        self.wait(monitor)
+        self.assertFalse(monitor.is_online())
+        self.assertEqual(self.probes, 1)
+
+        time.sleep(0.12)
+        monitor.is_online()
+        self.wait(monitor)
+        # the second failure doubles the delay before the next probe.
+        time.sleep(0.12)
+        self.assertFalse(monitor.is_online())
+        self.assertEqual(self.probes, 2)
+
+        self.assertFalse(monitor.is_online(force_refresh=True))
+        self.wait(monitor)
+        self.assertTrue(monitor.is_online())
+
+    def test_probe_errors(self):
+        def probe():
+            raise socket.error('unreachable')
+        monitor = ConnectivityMonitor(probe=probe)
+        monitor.is_online()
+        self.wait(monitor)
+        self.assertFalse(monitor.is_online())
+
+    def test_connect_api_host(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        api_base = prefs['api_base']
+        try:
+            prefs['api_base'] = 'http://127.0.0.1:%d/v1' % server.getsockname()[1]
+            self.assertTrue(ConnectivityMonitor()._connect_api_host())
+        finally:
+            prefs['api_base'] = api_base
+            server.close()
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestConnectivityMonitor)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,62 @@
+__author__ = 'jason'
+import unittest, os, shutil, tempfile, hashlib
+from calibre_plugins.quietthyme.client.filesource import FileSource, file_source
+
+class TestFileSource(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tempdir, 'book.epub')
+        self.contents = ''.join(chr(i % 256) for i in range(10000))
+        with open(self.filepath, 'wb') as f:
+            f.write(self.contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_view(self):
+        with FileSource(self.filepath) as source:
+            self.assertEqual(len(source), 10000)
+            self.assertEqual(str(source.view(100, 50)), self.contents[100:150])
+            # views are clamped to the end of the file.
+            self.assertEqual(str(source.view(9990, 50)), self.contents[9990:])
+            self.assertEqual(str(source.view(20000, 50)), '')
+
+    def test_slice(self):
+        with FileSource(self.filepath) as source:
+            part = source.slice(1000, 3000)
+            self.assertEqual(len(part), 3000)
+            self.assertEqual(''.join(str(chunk) for chunk in iter(lambda: part.read(700), '')), self.contents[1000:4000])
+            self.assertEqual(part.tell(), 3000)
+            part.seek(-10, os.SEEK_END)
+            self.assertEqual(str(part.read()), self.contents[3990:4000])
+            part.seek(0)
+            self.assertEqual(str(part.read(5)), self.contents[1000:1005])
+            self.assertEqual(str(source.slice().read()), self.contents)
+
+    def test_hash(self):
+        with FileSource(self.filepath) as source:
+            self.assertEqual(source.hash(chunk_size=4096), hashlib.sha1(self.contents).hexdigest())
+            self.assertEqual(source.hash('md5'), hashlib.md5(self.contents).hexdigest())
+
+    def test_empty_file(self):
+        empty_filepath = os.path.join(self.tempdir, 'empty.epub')
+        open(empty_filepath, 'wb').close()
+        with FileSource(empty_filepath) as source:
+            self.assertEqual(len(source), 0)
+            self.assertEqual(str(source.slice().read()), '')
+            self.assertEqual(source.hash(), hashlib.sha1('').hexdigest())
+
+    def test_file_source(self):
+        with file_source(self.filepath) as source:
+            self.assertEqual(source.filepath, self.filepath)
+        self.assertTrue(source._file.closed)
+
+        with FileSource(self.filepath) as opened:
+            with file_source(opened) as source:
+                self.assertTrue(source is opened)
+            # a FileSource that was passed in is left open for its owner.
+            self.assertFalse(opened._file.closed)
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestFileSource)
+unittest.TextTestRunner(verbosity=2).run(suite)
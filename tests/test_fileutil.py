@@ -0,0 +1,32 @@
+__author__ = 'jason'
+import unittest, os, shutil, tempfile
+from calibre_plugins.quietthyme.client.fileutil import ensure_dir, atomic_write
+
+class TestFileUtil(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_ensure_dir(self):
+        path = os.path.join(self.tempdir, 'quietthyme', 'images')
+        ensure_dir(path)
+        ensure_dir(path)
+        self.assertTrue(os.path.isdir(path))
+
+    def test_ensure_dir_over_file(self):
+        path = os.path.join(self.tempdir, 'status.json')
+        open(path, 'wb').close()
+        self.assertRaises(OSError, ensure_dir, path)
+
+    def test_atomic_write(self):
+        path = os.path.join(self.tempdir, 'quietthyme', 'status.json')
+        atomic_write(path, 'first')
+        atomic_write(path, 'second')
+        self.assertEqual(open(path, 'rb').read(), 'second')
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['status.json'])
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestFileUtil)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -1,5 +1,21 @@
-import unittest
+import unittest, os, shutil, tempfile, hashlib
+from calibre.ebooks.metadata.book.base import Metadata
+from calibre.devices.errors import UserFeedback
 from calibre_plugins.quietthyme import QuietthymeDevicePlugin
+from calibre_plugins.quietthyme.client.connectivity import ConnectivityMonitor
+from calibre_plugins.quietthyme.client.retry import RequestError
+from calibre_plugins.quietthyme.client.thumbnailcache import ThumbnailCache
+from calibre_plugins.quietthyme.client.statuscache import StatusCache
+from calibre_plugins.quietthyme.client import statuscache
+from calibre_plugins.quietthyme.config import prefs
+from calibre_plugins.quietthyme.models.booklist import BookList
+from calibre_plugins.quietthyme.models.bookindex import BookIndex
+from calibre_plugins.quietthyme.models import bookindex
+
+def create_qt_metadata(book_id):
+    return {'id': book_id, 'title': 'Title %d' % book_id, 'authors': ['Author'], 'tags': [], 'storage_size': 10,
+            'storage_type': 'dropbox', 'storage_filename': 'Title', 'storage_format': '.epub',
+            'cover': 'covers/%d.jpg' % book_id}
 
 class TestQuietthymeDevicePlugin(unittest.TestCase):
     def setUp(self):
@@ -14,9 +30,25 @@ class TestQuietthymeDevicePlugin(unittest.TestCase):
     def test_is_customizable(self):
         self.assertEqual(self.plugin.is_customizable(), False)
 
+    def wait_for_probe(self):
+        # the probe may already have finished (and cleared its task).
+        task = self.plugin.connectivity._probe_task
+        if task is not None:
+            task.result()
+
     def test_detect_managed_devices_can_connect(self):
+        self.plugin.connectivity = ConnectivityMonitor(probe=lambda: True)
+        # the first poll only starts the connectivity probe, it does not wait for it.
+        self.assertEqual(self.plugin.detect_managed_devices(None, False), None)
+        self.wait_for_probe()
         self.assertEqual(self.plugin.detect_managed_devices(None, False), True)
 
+    def test_detect_managed_devices_when_offline(self):
+        self.plugin.connectivity = ConnectivityMonitor(probe=lambda: False)
+        self.plugin.detect_managed_devices(None, False)
+        self.wait_for_probe()
+        self.assertEqual(self.plugin.detect_managed_devices(None, False), None)
+
     def test_detect_managed_devices_when_connected(self):
         self.plugin.is_connected = True
         self.assertEqual(self.plugin.detect_managed_devices(None, False), True)
@@ -25,6 +57,126 @@ class TestQuietthymeDevicePlugin(unittest.TestCase):
         self.plugin.is_ejected = True
         self.assertEqual(self.plugin.detect_managed_devices(None, False), None)
 
+    def test_refresh_status_survives_errors(self):
+        calls = []
+        def fetch_status(library_uuid):
+            calls.append(library_uuid)
+            raise ValueError('invalid status response')
+        self.plugin._fetch_status = fetch_status
+        self.plugin.qt_settings = {'main': {'free_space': 1}}
+        for i in range(2):
+            self.plugin._refresh_status()
+            task = self.plugin.status_refresh
+            if task is not None:
+                task.result()
+            self.assertEqual(self.plugin.status_refresh, None)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.plugin.qt_settings, {'main': {'free_space': 1}})
+
+    def test_upload_books_caches_covers(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        thumbnails = ThumbnailCache(tempdir, 1024)
+        thumbnails.fetch = lambda cover_path: thumbnails.put(cover_path, 'cover of %s' % cover_path)
+        self.patch(ThumbnailCache, '_default', thumbnails)
+        self.plugin._refresh_status = lambda: None
+        self.plugin._upload_book = lambda local_filepath, storage_id, local_metadata, replace_file: \
+            create_qt_metadata(1)
+        self.plugin.qt_settings = {'main': {'storage_id': 'storage'}}
+        filepath = os.path.join(tempdir, 'book.epub')
+        with open(filepath, 'wb') as f:
+            f.write('epub contents')
+
+        metadata = [Metadata('Title 1')]
+        dest_info = self.plugin.upload_books([filepath], ['book.epub'], metadata=metadata)
+        booklist = BookList(None, None, None)
+        # add_books_to_metadata does not download covers, they were cached by upload_books.
+        thumbnails.fetch = None
+        self.plugin.add_books_to_metadata(dest_info, metadata, (booklist, None, None))
+        self.assertEqual(booklist[0].thumbnail, 'cover of covers/1.jpg')
+
+    def test_upload_books_fails_after_every_upload(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        self.plugin._refresh_status = lambda: None
+        self.plugin.qt_settings = {'main': {'storage_id': 'storage'}}
+        uploaded = []
+        def upload_book(local_filepath, storage_id, local_metadata, replace_file):
+            if local_metadata.title != 'Title 2':
+                raise RequestError('storage is full')
+            uploaded.append(local_metadata.title)
+            return create_qt_metadata(2)
+        self.plugin._upload_book = upload_book
+        # every book is uploaded on its own, instead of with batch requests.
+        self.plugin._use_multipart_upload = lambda local_filepath: True
+        filepaths = []
+        for i in range(3):
+            filepaths.append(os.path.join(tempdir, '%d.epub' % i))
+            with open(filepaths[-1], 'wb') as f:
+                f.write('epub contents')
+
+        metadata = [Metadata('Title %d' % (i + 1)) for i in range(3)]
+        with self.assertRaises(UserFeedback) as context:
+            self.plugin.upload_books(filepaths, ['book.epub'] * 3, metadata=metadata)
+        self.assertEqual(uploaded, ['Title 2'])
+        self.assertEqual(context.exception.details.splitlines(), ['Title 1: storage is full', 'Title 3: storage is full'])
+
+    def create_stored_book(self, **qt_metadata):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        self.patch(bookindex, 'config_dir', tempdir)
+        local_filepath = os.path.join(tempdir, 'book.epub')
+        with open(local_filepath, 'wb') as f:
+            f.write('epub contents')
+        qt_indexed_data = {'id': 1, 'last_modified': 'a', 'storage_format': '.epub', 'storage_size': 13,
+                           'storage_filename': 'Book'}
+        qt_indexed_data.update(qt_metadata)
+        list(BookIndex('storage-id').sync([qt_indexed_data]))
+        return local_filepath
+
+    def find_unchanged_storage(self, local_filepath, storage_format='.epub'):
+        qt_book_data = {'id': 1}
+        qt_storage_metadata = {'storage_id': 'storage-id', 'storage_format': storage_format}
+        return self.plugin._find_unchanged_storage(qt_book_data, qt_storage_metadata, local_filepath), qt_book_data
+
+    def test_find_unchanged_storage_listed_hash(self):
+        local_filepath = self.create_stored_book(storage_hash=hashlib.sha1('epub contents').hexdigest())
+        unchanged, qt_book_data = self.find_unchanged_storage(local_filepath)
+        self.assertTrue(unchanged)
+        self.assertEqual(qt_book_data['storage_filename'], 'Book')
+        self.assertEqual(qt_book_data['storage_size'], 13)
+
+    def test_find_unchanged_storage_listed_hash_differs(self):
+        local_filepath = self.create_stored_book(storage_hash=hashlib.sha1('other contents').hexdigest())
+        # the listed hash wins over a matching recorded upload.
+        BookIndex('storage-id').record_upload({'id': 1, 'last_modified': 'a'}, hashlib.sha1('epub contents').hexdigest())
+        unchanged, qt_book_data = self.find_unchanged_storage(local_filepath)
+        self.assertFalse(unchanged)
+        self.assertEqual(qt_book_data, {'id': 1})
+
+    def test_find_unchanged_storage_last_upload(self):
+        local_filepath = self.create_stored_book()
+        self.assertFalse(self.find_unchanged_storage(local_filepath)[0])
+        BookIndex('storage-id').record_upload({'id': 1, 'last_modified': 'a', 'storage_filename': 'Uploaded'},
+                                              hashlib.sha1('epub contents').hexdigest())
+        unchanged, qt_book_data = self.find_unchanged_storage(local_filepath)
+        self.assertTrue(unchanged)
+        self.assertEqual(qt_book_data['storage_filename'], 'Uploaded')
+
+    def test_find_unchanged_storage_modified_since_last_upload(self):
+        local_filepath = self.create_stored_book(last_modified='b')
+        BookIndex('storage-id').record_upload({'id': 1, 'last_modified': 'a'}, hashlib.sha1('epub contents').hexdigest())
+        self.assertFalse(self.find_unchanged_storage(local_filepath)[0])
+
+    def test_find_unchanged_storage_other_format(self):
+        local_filepath = self.create_stored_book(storage_hash=hashlib.sha1('epub contents').hexdigest())
+        # the same contents, uploaded as another format, still has to be uploaded.
+        self.assertFalse(self.find_unchanged_storage(local_filepath, '.mobi')[0])
+
+    def patch(self, obj, name, value):
+        self.addCleanup(setattr, obj, name, getattr(obj, name))
+        setattr(obj, name, value)
+
     def test_open(self):
         with self.assertRaises(Exception) as context:
             self.plugin.open(True, 'test-library-uuid')
@@ -35,6 +187,26 @@ class TestQuietthymeDevicePlugin(unittest.TestCase):
         # self.assertEqual(self.plugin.qt_settings['main']['free_space'], 0)
         # self.assertEqual(self.plugin.qt_settings['main']['total_space'], 0)
 
+    def test_open_with_cached_status(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        self.patch(statuscache, 'config_dir', tempdir)
+        self.addCleanup(prefs.__setitem__, 'token', prefs['token'])
+        prefs['token'] = 'token'
+        settings = {'main': {'storage_id': 'storage-id', 'total_space': 100, 'free_space': 40}}
+        StatusCache(prefs['status_cache_ttl']).put('token', settings)
+
+        refreshed = []
+        self.plugin._refresh_status = lambda: refreshed.append(True)
+        self.plugin._fetch_status = lambda library_uuid: self.fail('the cached status was not used')
+        self.plugin.open(True, 'test-library-uuid')
+
+        # the plugin opens with the cached settings, and refreshes them in the background.
+        self.assertEqual(self.plugin.is_connected, True)
+        self.assertEqual(self.plugin.current_library_uuid, 'test-library-uuid')
+        self.assertEqual(self.plugin.qt_settings, settings)
+        self.assertEqual(refreshed, [True])
+
     def test_eject(self):
         self.plugin.eject()
         self.assertEqual(self.plugin.is_connected, False)
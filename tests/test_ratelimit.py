@@ -0,0 +1,94 @@
+__author__ = 'jason'
+import unittest, io, time, threading
+from calibre_plugins.quietthyme.client.ratelimit import TokenBucket, AdaptiveConcurrency, ThrottledReader
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(100, capacity=10)
+        start = time.time()
+        for i in range(10):
+            bucket.acquire()
+        self.assertTrue(time.time() - start < 0.05)
+        for i in range(10):
+            bucket.acquire()
+        self.assertTrue(time.time() - start >= 0.09)
+
+    def test_acquire_more_than_capacity(self):
+        bucket = TokenBucket(1000, capacity=10)
+        start = time.time()
+        bucket.acquire(60)
+        self.assertTrue(0.04 <= time.time() - start < 0.5)
+
+    def test_throttled_reader(self):
+        reader = ThrottledReader(io.BytesIO(b'x' * 300), TokenBucket(1000, capacity=100))
+        start = time.time()
+        data = b''
+        for chunk in iter(lambda: reader.read(50), b''):
+            data += chunk
+        self.assertEqual(len(data), 300)
+        self.assertTrue(time.time() - start >= 0.19)
+        reader.seek(0)
+        self.assertEqual(reader.read(10), b'x' * 10)
+
+    def test_disabled(self):
+        bucket = TokenBucket(0)
+        start = time.time()
+        for i in range(1000):
+            bucket.acquire()
+        self.assertTrue(time.time() - start < 0.05)
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+    def test_additive_increase(self):
+        concurrency = AdaptiveConcurrency(initial_limit=2, max_limit=4)
+        for i in range(20):
+            concurrency.acquire()
+            concurrency.release(0.1, 200)
+        self.assertEqual(concurrency.limit, 4)
+
+    def test_slow_responses_do_not_increase(self):
+        concurrency = AdaptiveConcurrency(initial_limit=2)
+        concurrency.acquire()
+        concurrency.release(0.1, 200)
+        limit = concurrency.limit
+        for i in range(5):
+            concurrency.acquire()
+            concurrency.release(1.0, 200)
+        self.assertEqual(concurrency.limit, limit)
+
+    def test_multiplicative_decrease(self):
+        concurrency = AdaptiveConcurrency(initial_limit=8, backoff_interval=60)
+        concurrency.acquire()
+        concurrency.release(0.1, 429)
+        self.assertEqual(concurrency.limit, 4)
+        # failures in the same window only count once.
+        concurrency.acquire()
+        concurrency.release(None, None)
+        self.assertEqual(concurrency.limit, 4)
+
+    def test_limits_requests_in_flight(self):
+        concurrency = AdaptiveConcurrency(initial_limit=2)
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def request():
+            concurrency.acquire()
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.pop()
+            concurrency.release(None, 404)
+
+        threads = [threading.Thread(target=request) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(peak), 2)
+
+
+suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(TestTokenBucket),
+                            unittest.TestLoader().loadTestsFromTestCase(TestAdaptiveConcurrency)])
+unittest.TextTestRunner(verbosity=2).run(suite)
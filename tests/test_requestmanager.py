@@ -0,0 +1,121 @@
+__author__ = 'jason'
+import unittest, os, shutil, tempfile, zlib
+from calibre_plugins.quietthyme.client.requestmanager import RequestManager, MultiPartForm
+from calibre_plugins.quietthyme.client.retry import RequestError
+from calibre_plugins.quietthyme.client.filesource import FileSource
+from calibre_plugins.quietthyme.config import prefs
+
+class TestMultiPartForm(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tempdir, 'book.epub')
+        with open(self.filepath, 'wb') as f:
+            f.write('epub contents ' * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def create_form(self, f):
+        form = MultiPartForm()
+        form.boundary = 'BOUNDARY'
+        form.add_field('book_id', '1')
+        form.add_field('format', 'epub')
+        # an explicit content type, guess_type depends on the mime types known to the machine.
+        form.add_file('file', 'book.epub', f, 'application/epub+zip')
+        return form
+
+    def test_encoding(self):
+        with open(self.filepath, 'rb') as f:
+            data = self.create_form(f).read()
+        self.assertEqual(data, '\r\n'.join([
+            '--BOUNDARY', 'Content-Disposition: form-data; name="book_id"', '', '1',
+            '--BOUNDARY', 'Content-Disposition: form-data; name="format"', '', 'epub',
+            '--BOUNDARY', 'Content-Disposition: file; name="file"; filename="book.epub"',
+            'Content-Type: application/epub+zip', '', 'epub contents ' * 1000,
+            '--BOUNDARY--', '']))
+
+    def test_content_length_and_chunked_reads(self):
+        with open(self.filepath, 'rb') as f:
+            form = self.create_form(f)
+            expected = form.read()
+            form.seek(0)
+            chunks = list(iter(lambda: form.read(100), ''))
+        self.assertEqual(form.get_content_length(), len(expected))
+        self.assertTrue(max(len(chunk) for chunk in chunks) <= 100)
+        self.assertEqual(''.join(chunks), expected)
+
+    def test_file_source(self):
+        with open(self.filepath, 'rb') as f:
+            expected = self.create_form(f).read()
+        with FileSource(self.filepath) as source:
+            form = self.create_form(source.slice())
+            self.assertEqual(form.get_content_length(), len(expected))
+            self.assertEqual(str(form.read()), expected)
+            form.seek(0)
+            self.assertEqual(''.join(str(chunk) for chunk in iter(lambda: form.read(100), '')), expected)
+
+class StandInResponse(object):
+    def __init__(self, body, content_encoding=None):
+        self.body = body
+        self.status = 200
+        self.headers = {'Content-Encoding': content_encoding} if content_encoding else {}
+
+    def read(self):
+        return self.body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+class TestReadBody(unittest.TestCase):
+    def test_encodings(self):
+        body = '{"success": true}' * 100
+        raw_deflate = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.assertEqual(RequestManager._read_body(StandInResponse(body)), body)
+        self.assertEqual(RequestManager._read_body(StandInResponse(RequestManager._gzip(body), 'gzip')), body)
+        self.assertEqual(RequestManager._read_body(StandInResponse(zlib.compress(body), 'deflate')), body)
+        self.assertEqual(RequestManager._read_body(StandInResponse(raw_deflate.compress(body) + raw_deflate.flush(), 'deflate')), body)
+        self.assertRaises(RequestError, RequestManager._read_body, StandInResponse(body, 'gzip'))
+
+class StandInPool(object):
+    def request(self, schema, domain, method, path, body=None, headers=None):
+        return None, StandInResponse('')
+
+class TestSend(unittest.TestCase):
+    def setUp(self):
+        self.pool = RequestManager.pool
+        RequestManager.pool = StandInPool()
+        self.rate_limiters = RequestManager.rate_limiters
+        RequestManager.rate_limiters = {}
+        self.limits = prefs['api_requests_per_second'], prefs['api_max_concurrency']
+
+    def tearDown(self):
+        prefs['api_requests_per_second'], prefs['api_max_concurrency'] = self.limits
+        RequestManager.rate_limiters = self.rate_limiters
+        RequestManager.pool = self.pool
+
+    def test_latency_sampled_for_api_requests_only(self):
+        concurrency = RequestManager.rate_limiter('api')[1]
+        # a streamed upload body is not sampled, its latency depends on its size.
+        RequestManager._send('https', 'example.com', 'PUT', '/book', MultiPartForm(), {}, 'api')
+        self.assertEqual(concurrency._min_latency, None)
+        RequestManager._send('https', 'example.com', 'POST', '/book', '{}', {}, 'api')
+        self.assertNotEqual(concurrency._min_latency, None)
+
+    def test_rate_limiter_rebuilt_when_prefs_change(self):
+        token_bucket, concurrency = RequestManager.rate_limiter('api')
+        self.assertEqual(RequestManager.rate_limiter('api'), (token_bucket, concurrency))
+
+        prefs['api_requests_per_second'] = 2
+        new_token_bucket, new_concurrency = RequestManager.rate_limiter('api')
+        self.assertEqual(new_token_bucket.rate, 2)
+        self.assertIs(new_concurrency, concurrency)
+
+        prefs['api_max_concurrency'] = 3
+        self.assertIs(RequestManager.rate_limiter('api')[0], new_token_bucket)
+        self.assertEqual(RequestManager.rate_limiter('api')[1].max_limit, 3)
+
+
+suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(TestMultiPartForm),
+                            unittest.TestLoader().loadTestsFromTestCase(TestReadBody),
+                            unittest.TestLoader().loadTestsFromTestCase(TestSend)])
+unittest.TextTestRunner(verbosity=2).run(suite)
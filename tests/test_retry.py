@@ -0,0 +1,93 @@
+__author__ = 'jason'
+import unittest, time
+from calibre_plugins.quietthyme.client.retry import RetryPolicy, CircuitBreaker, RequestError, CircuitOpenError, parse_retry_after
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.policy = RetryPolicy(max_attempts=3, base_delay=0, idempotent_endpoints=[('POST', '/book')])
+
+    def test_is_idempotent(self):
+        self.assertTrue(self.policy.is_idempotent('GET', '/storage/status'))
+        self.assertTrue(self.policy.is_idempotent('POST', '/book'))
+        # endpoints match exactly, not by prefix.
+        self.assertFalse(self.policy.is_idempotent('POST', '/book/delete/batch'))
+        self.assertFalse(self.policy.is_idempotent('POST', '/storage/complete/book/multipart'))
+
+    def test_should_retry(self):
+        self.assertTrue(self.policy.should_retry('GET', '/book', 1, RequestError('down')))
+        self.assertTrue(self.policy.should_retry('GET', '/book', 1, RequestError('error', 502)))
+        self.assertFalse(self.policy.should_retry('GET', '/book', 1, RequestError('missing', 404)))
+        self.assertFalse(self.policy.should_retry('GET', '/book', 3, RequestError('down')))
+        self.assertFalse(self.policy.should_retry('POST', '/storage/complete/book/multipart', 1, RequestError('error', 500)))
+        # throttled requests were not processed, so even non-idempotent requests are retried.
+        self.assertTrue(self.policy.should_retry('POST', '/storage/complete/book/multipart', 1, RequestError('slow down', 429)))
+        self.assertFalse(self.policy.should_retry('GET', '/book', 1, RequestError('slow down', 429, retry_after=3600)))
+
+    def test_backoff(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5)
+        for attempt in range(1, 10):
+            self.assertTrue(0 <= policy.backoff(attempt) <= 5)
+        self.assertEqual(self.policy.backoff(1, retry_after=2), 2)
+
+    def test_call(self):
+        results = [RequestError('error', 503), RequestError('error', 500), 'ok']
+        def send():
+            result = results.pop(0)
+            if isinstance(result, RequestError):
+                raise result
+            return result
+        self.assertEqual(self.policy.call('GET', '/book', send), 'ok')
+
+    def test_call_gives_up(self):
+        calls = []
+        def send():
+            calls.append(1)
+            raise RequestError('error', 500)
+        self.assertRaises(RequestError, self.policy.call, 'GET', '/book', send)
+        self.assertEqual(len(calls), 3)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('5'), 5)
+        self.assertEqual(parse_retry_after(None), None)
+        self.assertEqual(parse_retry_after('soon'), None)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_and_recovers(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.before_request()
+        breaker.record_result(False)
+        breaker.before_request()
+        breaker.record_result(False)
+        self.assertRaises(CircuitOpenError, breaker.before_request)
+
+        time.sleep(0.1)
+        # a single trial request is let through once the timeout passed.
+        breaker.before_request()
+        self.assertRaises(CircuitOpenError, breaker.before_request)
+        breaker.record_result(True)
+        breaker.before_request()
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_result(False)
+        time.sleep(0.1)
+        breaker.before_request()
+        breaker.record_result(False)
+        self.assertRaises(CircuitOpenError, breaker.before_request)
+
+    def test_trial_ends_on_other_errors(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_result(False)
+        time.sleep(0.1)
+
+        def send():
+            raise IOError('connection reset')
+        self.assertRaises(IOError, RetryPolicy().call, 'GET', '/books', send, breaker)
+        time.sleep(0.1)
+        self.assertEqual(RetryPolicy().call('GET', '/books', lambda: 'ok', breaker), 'ok')
+
+
+suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(TestRetryPolicy),
+                            unittest.TestLoader().loadTestsFromTestCase(TestCircuitBreaker)])
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,50 @@
+__author__ = 'jason'
+import unittest, os, json, shutil, tempfile
+from calibre_plugins.quietthyme.client.statuscache import StatusCache
+
+class TestStatusCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tempdir, 'quietthyme', 'status.json')
+        self.settings = {'main': {'storage_id': 'storage-id', 'total_space': 100, 'free_space': 40}}
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_put_and_get(self):
+        StatusCache(60, self.cache_path).put('token', self.settings)
+        # the settings survive into the next session.
+        self.assertEqual(StatusCache(60, self.cache_path).get('token'), self.settings)
+        self.assertFalse('token' in open(self.cache_path).read())
+
+    def test_other_token(self):
+        cache = StatusCache(60, self.cache_path)
+        cache.put('token', self.settings)
+        self.assertEqual(cache.get('another-token'), None)
+
+    def test_expired(self):
+        StatusCache(60, self.cache_path).put('token', self.settings)
+        self.assertEqual(StatusCache(0, self.cache_path).get('token'), None)
+
+        with open(self.cache_path, 'rb') as f:
+            entry = json.load(f)
+        entry['fetched_at'] -= 61
+        with open(self.cache_path, 'wb') as f:
+            json.dump(entry, f)
+        self.assertEqual(StatusCache(60, self.cache_path).get('token'), None)
+
+    def test_missing_and_corrupt(self):
+        cache = StatusCache(60, self.cache_path)
+        self.assertEqual(cache.get('token'), None)
+        cache.clear()
+        os.makedirs(os.path.dirname(self.cache_path))
+        with open(self.cache_path, 'wb') as f:
+            f.write('{not json')
+        self.assertEqual(cache.get('token'), None)
+        cache.put('token', self.settings)
+        cache.clear()
+        self.assertEqual(cache.get('token'), None)
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestStatusCache)
+unittest.TextTestRunner(verbosity=2).run(suite)
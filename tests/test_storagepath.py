@@ -0,0 +1,37 @@
+__author__ = 'jason'
+import unittest
+from calibre_plugins.quietthyme.models.storagepath import StoragePath
+
+class TestStoragePath(unittest.TestCase):
+    def test_parse(self):
+        storage_path = StoragePath.parse('quietthyme://12/Author/Title - Author.epub')
+        self.assertEqual(storage_path.storage_type, 'quietthyme')
+        self.assertEqual(storage_path.book_id, '12')
+        self.assertEqual(storage_path.file_name, 'Author/Title - Author.epub')
+        self.assertEqual(storage_path.path, 'quietthyme://12/Author/Title - Author.epub')
+
+    def test_parse_prefixed(self):
+        storage_path = StoragePath.parse('/device/prefix/dropbox://7/book.mobi')
+        self.assertEqual(storage_path, StoragePath('dropbox', 7, 'book.mobi'))
+        self.assertEqual(storage_path.path, 'dropbox://7/book.mobi')
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, StoragePath.parse, 'placeholder.ignore')
+        self.assertRaises(ValueError, StoragePath.parse, 'quietthyme://12')
+        self.assertEqual(StoragePath.try_parse('placeholder.ignore'), None)
+
+    def test_memoized(self):
+        path = 'quietthyme://13/book.epub'
+        self.assertTrue(StoragePath.parse(path) is StoragePath.parse(path))
+
+    def test_value(self):
+        storage_path = StoragePath(u'quietthyme', 14, u'Caf\xe9.epub')
+        self.assertEqual(storage_path.book_id, u'14')
+        self.assertEqual(unicode(storage_path), u'quietthyme://14/Caf\xe9.epub')
+        self.assertEqual(str(storage_path), 'quietthyme://14/Caf\xc3\xa9.epub')
+        self.assertEqual(len(set([storage_path, StoragePath('quietthyme', '14', u'Caf\xe9.epub')])), 1)
+        self.assertFalse(hasattr(storage_path, '__dict__'))
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestStoragePath)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,38 @@
+__author__ = 'jason'
+import unittest, shutil, tempfile
+from calibre_plugins.quietthyme.client.thumbnailcache import ThumbnailCache
+from calibre_plugins.quietthyme.client.requestmanager import RequestManager
+from calibre_plugins.quietthyme.client.retry import RequestError
+
+class TestThumbnailCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = ThumbnailCache(self.tempdir, 1024)
+        self.requests = []
+        self.create_request = RequestManager.create_request
+        def create_request(action, url, **kwargs):
+            self.requests.append(url)
+            if 'broken' in url:
+                raise RequestError('Not Found (404)', 404)
+            return 'cover of ' + url
+        RequestManager.create_request = staticmethod(create_request)
+
+    def tearDown(self):
+        RequestManager.create_request = self.create_request
+        shutil.rmtree(self.tempdir)
+
+    def test_prefetch(self):
+        self.cache.prefetch(['covers/1.jpg', 'covers/broken.jpg', None])
+        self.assertEqual(len(self.requests), 2)
+        self.assertTrue(self.cache.get('covers/1.jpg').startswith('cover of'))
+        self.assertEqual(self.cache.get('covers/broken.jpg'), None)
+
+    def test_failed_covers_are_not_requested_again(self):
+        self.cache.prefetch(['covers/broken.jpg'])
+        self.cache.prefetch(['covers/broken.jpg'])
+        self.assertEqual(self.cache.fetch('covers/broken.jpg'), None)
+        self.assertEqual(len(self.requests), 1)
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestThumbnailCache)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,44 @@
+__author__ = 'jason'
+import unittest, os, shutil, tempfile, hashlib
+from calibre_plugins.quietthyme.client.uploadjournal import UploadJournal
+from calibre_plugins.quietthyme.client.filesource import FileSource
+
+class TestUploadJournal(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.journal = UploadJournal(os.path.join(self.tempdir, 'uploads.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def create_source(self, name, contents):
+        filepath = os.path.join(self.tempdir, name)
+        with open(filepath, 'wb') as f:
+            f.write(contents)
+        source = FileSource(filepath)
+        self.addCleanup(source.close)
+        return source
+
+    def test_key_hashes_whole_file(self):
+        # the same size, start and end, only the middle differs.
+        edges = 'e' * (64 * 1024)
+        source = self.create_source('a.epub', edges + 'a' * 1000 + edges)
+        other = self.create_source('b.epub', edges + 'b' * 1000 + edges)
+        self.assertNotEqual(UploadJournal.key('storage-id', 1, source), UploadJournal.key('storage-id', 1, other))
+        self.assertEqual(UploadJournal.key('storage-id', 1, source),
+                         'storage-id:1:%s' % hashlib.sha1(edges + 'a' * 1000 + edges).hexdigest())
+        self.assertEqual(UploadJournal.key('storage-id', 1, source, 'known-hash'), 'storage-id:1:known-hash')
+
+    def test_record_parts(self):
+        self.journal.start('key', 'upload-1', 4)
+        self.journal.record_part('key', 1, 'etag-1')
+        self.journal.record_part('other-key', 1, 'etag-1')
+        self.assertEqual(UploadJournal(self.journal.journal_path).get('key'),
+                         {'upload_id': 'upload-1', 'part_size': 4, 'parts': {'1': 'etag-1'}})
+        self.assertEqual(self.journal.get('other-key'), None)
+        self.journal.remove('key')
+        self.assertEqual(self.journal.get('key'), None)
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestUploadJournal)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,46 @@
+__author__ = 'jason'
+import unittest, threading, time
+from calibre_plugins.quietthyme.client.workerpool import WorkerPool
+
+class TestWorkerPool(unittest.TestCase):
+    def test_map_keeps_input_order(self):
+        # later items finish first.
+        def func(i):
+            time.sleep(0.01 * (5 - i))
+            return i * 2
+        self.assertEqual(WorkerPool(5).map(func, range(5)), [0, 2, 4, 6, 8])
+
+    def test_map_progress(self):
+        progress = []
+        callback = lambda completed, total: progress.append((completed, total, threading.current_thread()))
+        WorkerPool(3).map(lambda i: i, range(4), callback)
+        self.assertEqual([(completed, total) for completed, total, thread in progress], [(1, 4), (2, 4), (3, 4), (4, 4)])
+        self.assertTrue(all(thread is threading.current_thread() for completed, total, thread in progress))
+
+    def test_map_stops_after_error(self):
+        started = []
+        finished = []
+        def func(i):
+            started.append(i)
+            if i == 0:
+                raise ValueError('failed')
+            time.sleep(0.1)
+            finished.append(i)
+        self.assertRaises(ValueError, WorkerPool(2).map, func, range(10))
+        # the items that were running next to the failed one finished before the error was raised,
+        # and the remaining items were never started.
+        self.assertTrue(len(started) < 5)
+        self.assertEqual(sorted(finished), sorted(started)[1:])
+
+    def test_imap_unordered_exc_info(self):
+        def func(i):
+            if i == 1:
+                raise ValueError('failed')
+            return i
+        results = sorted(WorkerPool(2).imap_unordered(func, range(3)))
+        self.assertEqual([(index, result) for index, result, exc_info in results], [(0, 0), (1, None), (2, 2)])
+        self.assertTrue(results[1][2][0] is ValueError)
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestWorkerPool)
+unittest.TextTestRunner(verbosity=2).run(suite)